@@ -17,6 +17,12 @@ import math
 from transform import Trackball, identity
 
 # ------------ low level OpenGL object wrappers ----------------------------
+class Locations(dict):
+    """ Uniform name -> location table, unknown names map to -1 like GL """
+    def __missing__(self, name):
+        return -1
+
+
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
@@ -39,6 +45,7 @@ class Shader:
     def __init__(self, vertex_source, fragment_source):
         """ Shader can be initialized with raw strings or source file names """
         self.glid = None
+        self.uniforms, self.attributes, self.loc = {}, {}, Locations()
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
@@ -53,6 +60,28 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 self.glid = None
+            else:
+                self._introspect()
+
+    def _introspect(self):
+        """ Query active uniforms & attributes once, right after linking.
+            Tables map name -> (location, GL type, array size), and self.loc
+            is the location-only view used by objects drawn with the shader """
+        nb_uniforms = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)
+        for index in range(nb_uniforms):
+            name, size, gl_type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetUniformLocation(self.glid, name)
+            name = name[:-3] if name.endswith('[0]') else name  # array name
+            self.uniforms[name] = (location, gl_type, size)
+            if location >= 0:  # uniform block members have no location
+                self.loc[name] = location
+        nb_attributes = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_ATTRIBUTES)
+        for index in range(nb_attributes):
+            name, size, gl_type = GL.glGetActiveAttrib(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetAttribLocation(self.glid, name)
+            self.attributes[name] = (location, gl_type, size)
 
     def __del__(self):
         GL.glUseProgram(0)
@@ -94,19 +123,16 @@ class SimpleTriangle:
 
     def draw(self, projection, view, model):
         GL.glUseProgram(self.shader.glid)
-        my_color_location = GL.glGetUniformLocation(self.shader.glid, 'color')
-        GL.glUniform3fv(my_color_location, 1, (0.6, 0.6, 0.9))
+        loc = self.shader.loc  # looked up once when the shader was linked
+        GL.glUniform3fv(loc['color'], 1, (0.6, 0.6, 0.9))
 
-        matrix_location = GL.glGetUniformLocation(self.shader.glid, 'matrix')
         translate_mat = translate(math.cos(glfw.get_time()))
         rotate_mat = rotate(vec(0, 1, 0), 45 * glfw.get_time()*360/120)
-        GL.glUniformMatrix4fv(matrix_location, 1, True,  rotate_mat)
+        GL.glUniformMatrix4fv(loc['matrix'], 1, True,  rotate_mat)
 
         # Pass the projection and view matrices
-        proj = GL.glGetUniformLocation(self.shader.glid, 'projection_matrix')
-        GL.glUniformMatrix4fv(proj, 1, True,  projection)
-        vie = GL.glGetUniformLocation(self.shader.glid, 'view_matrix')
-        GL.glUniformMatrix4fv(vie, 1, True,  view)
+        GL.glUniformMatrix4fv(loc['projection_matrix'], 1, True,  projection)
+        GL.glUniformMatrix4fv(loc['view_matrix'], 1, True,  view)
 
         # draw triangle as GL_TRIANGLE vertex array, draw array call
         GL.glBindVertexArray(self.glid)
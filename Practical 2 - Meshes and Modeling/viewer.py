@@ -15,6 +15,12 @@ from itertools import cycle         # cyclic iterator to easily toggle polygon r
 import assimpcy
 
 # ------------ low level OpenGL object wrappers ----------------------------
+class Locations(dict):
+    """ Uniform name -> location table, unknown names map to -1 like GL """
+    def __missing__(self, name):
+        return -1
+
+
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
@@ -37,6 +43,7 @@ class Shader:
     def __init__(self, vertex_source, fragment_source):
         """ Shader can be initialized with raw strings or source file names """
         self.glid = None
+        self.uniforms, self.attributes, self.loc = {}, {}, Locations()
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
@@ -51,6 +58,27 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 GL.glDeleteProgram(self.glid)
                 sys.exit(1)
+            self._introspect()
+
+    def _introspect(self):
+        """ Query active uniforms & attributes once, right after linking.
+            Tables map name -> (location, GL type, array size), and self.loc
+            is the location-only view used by objects drawn with the shader """
+        nb_uniforms = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)
+        for index in range(nb_uniforms):
+            name, size, gl_type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetUniformLocation(self.glid, name)
+            name = name[:-3] if name.endswith('[0]') else name  # array name
+            self.uniforms[name] = (location, gl_type, size)
+            if location >= 0:  # uniform block members have no location
+                self.loc[name] = location
+        nb_attributes = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_ATTRIBUTES)
+        for index in range(nb_attributes):
+            name, size, gl_type = GL.glGetActiveAttrib(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetAttribLocation(self.glid, name)
+            self.attributes[name] = (location, gl_type, size)
 
     def __del__(self):
         GL.glUseProgram(0)
@@ -134,11 +162,9 @@ class Pyramid:
     def draw(self, projection, view, model):
         GL.glUseProgram(self.shader.glid)
 
-        loc = GL.glGetUniformLocation(self.shader.glid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-
-        loc = GL.glGetUniformLocation(self.shader.glid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
+        loc = self.shader.loc  # looked up once when the shader was linked
+        GL.glUniformMatrix4fv(loc['view'], 1, True, view)
+        GL.glUniformMatrix4fv(loc['projection'], 1, True, projection)
 
         self.array.execute(GL.GL_TRIANGLES)
 
@@ -164,11 +190,9 @@ class Mesh:
         GL.glUseProgram(self.shader.glid)
         
         # instantiate uniform matrices that are need in all drawables
-        loc = GL.glGetUniformLocation(self.shader.glid, 'view')
-        GL.glUniformMatrix4fv(loc, 1, True, view)
-
-        loc = GL.glGetUniformLocation(self.shader.glid, 'projection')
-        GL.glUniformMatrix4fv(loc, 1, True, projection)
+        loc = self.shader.loc  # looked up once when the shader was linked
+        GL.glUniformMatrix4fv(loc['view'], 1, True, view)
+        GL.glUniformMatrix4fv(loc['projection'], 1, True, projection)
 
         # draw the Mesh by executing the VertexArray
         self.array.execute(primitive=primitives)
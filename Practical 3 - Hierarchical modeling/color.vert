@@ -4,10 +4,13 @@
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 color;
 
-// global matrix variables
+// global matrix variables, camera ones shared by all shaders once per frame
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 
 // interpolated color for fragment shader, intialized at vertices
 out vec3 fragment_color;
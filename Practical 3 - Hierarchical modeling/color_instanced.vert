@@ -0,0 +1,26 @@
+#version 330 core
+
+// input attribute variable, given per vertex
+layout(location = 0) in vec3 position;
+layout(location = 1) in vec3 color;
+
+// model matrix given per instance, one column per location 4 to 7
+layout(location = 4) in mat4 model;
+
+// camera matrices shared by all shaders once per frame
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+
+// interpolated color for fragment shader, intialized at vertices
+out vec3 fragment_color;
+
+void main() {
+    // initialize interpolated colors at vertices
+    fragment_color = color;
+
+    // tell OpenGL how to transform the vertex to clip coordinates
+    gl_Position = projection * view * model * vec4(position, 1);
+}
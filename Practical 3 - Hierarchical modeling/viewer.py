@@ -11,7 +11,9 @@ import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
-from core import Shader, Mesh, Node, Viewer, RotationControlNode
+from core import Shader, Mesh, Node, Viewer, RotationControlNode, VertexArray
+import meshopt                      # vertex welding
+import meshcache                    # binary cache of imported scenes
 from transform import translate, rotate, scale
 
 
@@ -46,18 +48,30 @@ class Cylinder(Node):
 
 
 # -------------- 3D resource loader -----------------------------------------
-def load(file, shader):
-    """ load resources from file using assimpcy, return list of ColorMesh """
+def load(file, shader, arena=None, weld=True):
+    """ load resources from file using assimpcy, return list of ColorMesh.
+        Mesh geometry goes to the optional GeometryArena shared buffers,
+        once weld has merged duplicate vertices """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_GenSmoothNormals
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = meshcache.load_scene(file, flags)  # cached import
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
 
-    meshes = [Mesh(shader, [m.mVertices, m.mNormals], m.mFaces)
-              for m in scene.mMeshes]
+    geometry = [([m.mVertices, m.mNormals], m.mFaces) for m in scene.mMeshes]
+    if weld:  # duplicate vertices, as assimp does not join them
+        geometry = meshopt.weld_geometry(file, geometry)
+
+    # one interleaved vertex buffer per mesh: fewer buffers, better locality
+    meshes = []
+    for attributes, faces in geometry:
+        if arena:
+            meshes.append(Mesh(shader, arena.add(attributes, faces)))
+        else:
+            meshes.append(Mesh(shader, VertexArray(attributes, faces,
+                                                   interleaved=True)))
     size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
     return meshes
@@ -69,8 +83,8 @@ def main():
     """ create a window, add scene objects, then run rendering loop """
     viewer = Viewer()
 
-    # default color shader
-    shader = Shader("color.vert", "color.frag")
+    # default color shader, with its variant drawing many instances at once
+    shader = Shader("color.vert", "color.frag", "color_instanced.vert")
 
     axis = Axis(shader)
 
@@ -14,8 +14,12 @@ uniform vec3 k_s;
 // uniform vec3 r;
 uniform float s;
 
-// world camera position
-uniform vec3 w_camera_position;
+// world camera position, from the per-frame camera block
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 
 out vec4 out_color;
 
@@ -3,7 +3,14 @@
 layout(location = 0) in vec3 position;
 layout(location = 1) in vec3 normal;
 
-uniform mat4 model, view, projection;
+uniform mat4 model;
+
+// camera matrices, shared by all shaders and uploaded once per frame
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 
 // position and normal for the fragment shader, in WORLD coordinates
 // (you can also compute in VIEW coordinates, your choice! rename variables)
@@ -13,8 +13,11 @@ import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
-from core import Shader, Mesh, Node, Viewer
+from core import Shader, Mesh, Node, Viewer, VertexArray, render_state
+from core import GeometryArena, LODNode, load_parallel
 from transform import rotate
+import meshopt                      # mesh simplification & its disk cache
+import meshcache                    # binary cache of imported scenes
 
 
 # -------------- Phong rendered Mesh class -----------------------------------
@@ -29,18 +32,12 @@ class PhongMesh(Mesh):
         print(light_dir)
         self.light_dir = light_dir
         self.k_a, self.k_d, self.k_s, self.s = k_a, k_d, k_s, s
-
-        # retrieve OpenGL locations of shader variables at initialization
-        names = ['light_dir', 'k_a', 's', 'k_s', 'k_d', 'w_camera_position']
-
-        loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
-        self.loc.update(loc)
         
         self.i = 0
         self.x_vals = np.linspace(-10, 10, num=500)
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
         # self.light_dir = [(item * glfw.get_time()) % 100 for item in self.light_dir]
         # self.light_dir[0] = self.x_vals[self.i]
@@ -55,41 +52,102 @@ class PhongMesh(Mesh):
         GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
         GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
 
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+        # world camera position for the specular component comes from the
+        # per-frame Camera uniform block, no inverse view needed per mesh
 
         super().draw(projection, view, model, primitives)
 
 
 # -------------- 3D resource loader -----------------------------------------
-def load_phong_mesh(file, shader, light_dir):
-    """ load resources from file using assimp, return list of ColorMesh """
+def prepare_phong_mesh(file, lod=False, optimize=False, weld=True):
+    """ CPU side of load_phong_mesh, free of OpenGL so that it can run in a
+        worker process: import, weld, reorder & simplify the meshes of file.
+        Returns picklable (geometry, lods, materials, size), None on error """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_GenSmoothNormals
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = meshcache.load_scene(file, flags)  # cached import
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
+        return None
+
+    geometry = [([mesh.mVertices, mesh.mNormals], mesh.mFaces)
+                for mesh in scene.mMeshes]
+    if weld:  # duplicate vertices, as assimp does not join them
+        geometry = meshopt.weld_geometry(file, geometry)
+    if optimize:  # cached reordering, also printing cache statistics
+        geometry = meshopt.optimize_geometry(file, geometry)
+    lods = None
+    if lod:  # index arrays of each level
+        lods = meshopt.load_lods(file, [(attributes[0], faces)
+                                        for attributes, faces in geometry])
+    materials = [dict(scene.mMaterials[mesh.mMaterialIndex].properties)
+                 for mesh in scene.mMeshes]
+    size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
+    return geometry, lods, materials, size
+
+
+def build_phong_mesh(file, prepared, shader, light_dir, arena=None,
+                     quantize=False):
+    """ GL side of load_phong_mesh, on the main thread: upload the prepared
+        meshes of file, return list of PhongMesh, or LODNode of them """
+    if prepared is None:
         return []
+    geometry, lods, materials, size = prepared
+    if lods is not None:  # all levels sharing one arena
+        arena = arena or GeometryArena()
+    quantize = ('position', 'normal') if quantize else ()
 
     # prepare mesh nodes
     meshes = []
-    for mesh in scene.mMeshes:
-        mat = scene.mMaterials[mesh.mMaterialIndex].properties
-        mesh = PhongMesh(shader, [mesh.mVertices, mesh.mNormals], mesh.mFaces,
-                         k_d=mat.get('COLOR_DIFFUSE', (1, 1, 1)),
-                         k_s=mat.get('COLOR_SPECULAR', (1, 1, 1)),
-                         k_a=mat.get('COLOR_AMBIENT', (0, 0, 0)),
-                         s=mat.get('SHININESS', 16.),
-                         light_dir=light_dir)
-        meshes.append(mesh)
+    for index, (attributes, faces) in enumerate(geometry):
+        mat = materials[index]
+        if lods is not None:
+            levels = arena.add_levels(attributes, lods[index], quantize)
+        elif arena:  # range of the shared GeometryArena buffers
+            levels = [arena.add(attributes, faces, quantize)]
+        else:
+            levels = [VertexArray(attributes, faces, interleaved=True,
+                                  quantize=quantize)]
+        levels = [PhongMesh(shader, level,
+                            k_d=mat.get('COLOR_DIFFUSE', (1, 1, 1)),
+                            k_s=mat.get('COLOR_SPECULAR', (1, 1, 1)),
+                            k_a=mat.get('COLOR_AMBIENT', (0, 0, 0)),
+                            s=mat.get('SHININESS', 16.),
+                            light_dir=light_dir)
+                  for level in levels]
+        meshes.append(LODNode(levels) if lods is not None else levels[0])
 
-    size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
     return meshes
 
 
+def load_phong_mesh(file, shader, light_dir, arena=None, lod=False,
+                    optimize=False, weld=True, quantize=False):
+    """ load resources from file using assimp, return list of ColorMesh.
+        With lod, each mesh is a LODNode of simplified versions sharing its
+        vertices, simplification being cached on disk next to the file.
+        Optimize reorders triangles and vertices for GPU cache locality,
+        after weld has merged duplicate vertices. Quantize stores int16
+        positions and packed 10 bit normals, 12 bytes instead of 24 """
+    prepared = prepare_phong_mesh(file, lod, optimize, weld)
+    return build_phong_mesh(file, prepared, shader, light_dir, arena,
+                            quantize)
+
+
+def load_phong_meshes(files, shader, light_dir, arena=None, lod=False,
+                      optimize=False, weld=True, quantize=False):
+    """ load_phong_mesh of several files, parsed and processed in parallel
+        by worker processes while meshes are uploaded here as each file is
+        done. Yields (file, meshes) in completion order """
+    if lod:  # levels of all files in one arena
+        arena = arena or GeometryArena()
+    for file, prepared in load_parallel(prepare_phong_mesh, files,
+                                        lod, optimize, weld):
+        yield file, build_phong_mesh(file, prepared, shader, light_dir,
+                                     arena, quantize)
+
+
 # -------------- main program and scene setup --------------------------------
 def main():
     """ create a window, add scene objects, then run rendering loop """
@@ -100,12 +158,19 @@ def main():
     viewer.add(node)
 
     light_dir = (0, 0, -10)
-    node.add(*[mesh for file in sys.argv[1:]
-               for mesh in load_phong_mesh(file, shader, light_dir)])
-
-    if len(sys.argv) != 2:
-        print('Usage:\n\t%s [3dfile]*\n\n3dfile\t\t the filename of a model in'
-              ' format supported by assimp.' % (sys.argv[0],))
+    # vertex cache reordering is slow on a first run, see meshopt.py to
+    # precompute it offline
+    optimize = '--optimize' in sys.argv
+    files = [arg for arg in sys.argv[1:] if arg != '--optimize']
+
+    # files are parsed in parallel, meshes added as soon as each is ready
+    for _, meshes in load_phong_meshes(files, shader, light_dir, lod=True,
+                                       optimize=optimize):
+        node.add(*meshes)
+
+    if len(files) != 1:
+        print('Usage:\n\t%s [--optimize] [3dfile]*\n\n3dfile\t\t the filename'
+              ' of a model in format supported by assimp.' % (sys.argv[0],))
 
     # start rendering loop
     viewer.run()
@@ -1,7 +1,11 @@
 # Python built-in modules
+import ctypes                       # byte offsets into OpenGL buffers
 import os                           # os function, i.e. checking file status
 import sys                          # for sys.exit
+from collections import Counter     # per-frame statistics counters
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import cycle         # allows easy circular choice list
+import multiprocessing              # process pool start method
 
 # External, non built-in modules
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
@@ -12,7 +16,161 @@ import numpy as np                  # all matrix manipulations & OpenGL args
 from transform import Trackball, identity
 
 
+# ------------ render state cache, skipping redundant OpenGL calls -----------
+frame_stats = Counter()  # per-frame render counters, collected by Viewer.run
+
+
+class RenderState:
+    """ Shadow copy of the bound OpenGL objects, so that a bind only reaches
+        OpenGL when the state actually changes. Every call to OpenGL costs
+        Python overhead, skipped calls are counted in frame_stats. """
+    def __init__(self):
+        self.program, self.vertex_array, self.unit = None, None, None
+        self.textures = {}  # (texture unit, target) -> bound texture id
+        self.samplers = {}  # texture unit -> bound sampler id
+        self.values = {}    # (program, location) -> integer uniform value
+        self.capabilities = {}  # GL capability, e.g. face culling -> enabled
+
+    def use_program(self, glid):
+        """ glUseProgram, if glid is not already the current program """
+        if glid == self.program:
+            frame_stats['gl_calls_saved'] += 1
+            return
+        GL.glUseProgram(glid)
+        self.program = glid
+        frame_stats['gl_calls'] += 1
+
+    def bind_vertex_array(self, glid):
+        """ glBindVertexArray, if glid is not already bound """
+        if glid == self.vertex_array:
+            frame_stats['gl_calls_saved'] += 1
+            return
+        GL.glBindVertexArray(glid)
+        self.vertex_array = glid
+        frame_stats['gl_calls'] += 1
+
+    def bind_texture(self, glid, unit=0, target=GL.GL_TEXTURE_2D):
+        """ glActiveTexture + glBindTexture, each only when needed """
+        if self.textures.get((unit, target)) == glid:
+            frame_stats['gl_calls_saved'] += 2
+            return
+        if unit != self.unit:
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+            self.unit = unit
+            frame_stats['gl_calls'] += 1
+        else:
+            frame_stats['gl_calls_saved'] += 1
+        GL.glBindTexture(target, glid)
+        self.textures[(unit, target)] = glid
+        frame_stats['gl_calls'] += 1
+
+    def bind_sampler(self, glid, unit=0):
+        """ glBindSampler, only when unit has another sampler bound """
+        if self.samplers.get(unit) == glid:
+            frame_stats['gl_calls_saved'] += 1
+            return
+        GL.glBindSampler(unit, glid)
+        self.samplers[unit] = glid
+        frame_stats['gl_calls'] += 1
+
+    def uniform1i(self, location, value):
+        """ glUniform1i on the current program, e.g. sampler units, only
+            when the value differs from the last one set for this location """
+        key = (self.program, location)
+        if self.values.get(key) == value:
+            frame_stats['gl_calls_saved'] += 1
+            return
+        GL.glUniform1i(location, value)
+        self.values[key] = value
+        frame_stats['gl_calls'] += 1
+
+    def enable(self, capability, enabled=True):
+        """ glEnable, or glDisable if not enabled, only when capability is in
+            the other state. Returns the previous state, to restore it """
+        previous = self.capabilities.get(capability)
+        if previous is None:  # unknown yet, e.g. after invalidate
+            previous = bool(GL.glIsEnabled(capability))
+        self.capabilities[capability] = enabled
+        if previous == enabled:
+            frame_stats['gl_calls_saved'] += 1
+            return previous
+        (GL.glEnable if enabled else GL.glDisable)(capability)
+        frame_stats['gl_calls'] += 1
+        return previous
+
+    def invalidate(self):
+        """ Forget everything, e.g. when GL objects die: their ids can be
+            reused by new objects, or state was changed behind our back """
+        self.__init__()
+
+
+render_state = RenderState()  # single GL context => single state shadow
+memory_stats = Counter()  # cumulative GPU memory bookkeeping, in bytes
+frame_tasks = []  # called by Viewer.run each frame, dropped on False return
+
+
+# ------------ bounding volumes & view frustum ------------------------------
+class Bounds:
+    """ Axis aligned bounding box and bounding sphere of a set of points, in
+        the local frame of their mesh, computed once at load time """
+    def __init__(self, points):
+        points = np.asarray(points, np.float32).reshape(len(points), -1)
+        padded = np.zeros((len(points), 3), np.float32)  # e.g. 2D positions
+        padded[:, :min(points.shape[1], 3)] = points[:, :3]
+        if not len(padded):
+            padded = np.zeros((1, 3), np.float32)
+        self.lo, self.hi = padded.min(axis=0), padded.max(axis=0)
+        self.center = (self.lo + self.hi) / 2
+        self.extent = (self.hi - self.lo) / 2  # box half size
+        self.radius = np.sqrt(((padded - self.center) ** 2).sum(axis=1).max())
+
+    def corners(self):
+        """ the 8 corners of the box, as a (8, 3) array """
+        grid = np.meshgrid(*zip(self.lo, self.hi), indexing='ij')
+        return np.stack(grid, axis=-1).reshape(-1, 3)
+
+    @staticmethod
+    def merge(boxes, matrix):
+        """ Bounds enclosing all boxes once transformed by matrix """
+        corners = np.concatenate([box.corners() for box in boxes])
+        return Bounds(corners @ matrix[:3, :3].T + matrix[:3, 3])
+
+
+def frustum_planes(clip):
+    """ The 6 planes (a, b, c, d) of the view frustum of clip matrix, e.g.
+        projection @ view, with inside points p verifying a.p + d >= 0 """
+    planes = np.array([clip[3] + clip[0], clip[3] - clip[0],   # left, right
+                       clip[3] + clip[1], clip[3] - clip[1],   # bottom, top
+                       clip[3] + clip[2], clip[3] - clip[2]])  # near, far
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def world_boxes(worlds, centers, extents):
+    """ Axis aligned world boxes enclosing n local boxes (centers, extents)
+        under n world matrices: the world center, and the extents scaled by
+        the absolute value of the rotation part """
+    world_centers = np.einsum('nij,nj->ni', worlds[:, :3, :3], centers)
+    world_centers += worlds[:, :3, 3]
+    extents = np.einsum('nij,nj->ni', np.abs(worlds[:, :3, :3]), extents)
+    return world_centers, extents
+
+
+def boxes_visible(planes, worlds, centers, extents):
+    """ Visibility of n local boxes (centers, extents) under n world matrices:
+        their world box must not lie entirely behind one frustum plane """
+    world_centers, extents = world_boxes(worlds, centers, extents)
+    distances = world_centers @ planes[:, :3].T + planes[:, 3]
+    radii = extents @ np.abs(planes[:, :3]).T  # box support distance
+    return np.all(distances >= -radii, axis=1)
+
+
 # ------------ low level OpenGL object wrappers ----------------------------
+class Locations(dict):
+    """ Uniform name -> location table, unknown names map to -1 like GL """
+    def __missing__(self, name):
+        return -1
+
+
 class Shader:
     """ Helper class to create and automatically destroy shader program """
     @staticmethod
@@ -32,9 +190,13 @@ class Shader:
             sys.exit(1)
         return shader
 
-    def __init__(self, vertex_source, fragment_source):
-        """ Shader can be initialized with raw strings or source file names """
+    def __init__(self, vertex_source, fragment_source, instanced_source=None):
+        """ Shader can be initialized with raw strings or source file names.
+            Optional instanced_source is a vertex shader variant reading its
+            'model' matrix per instance at location 4, linked with the same
+            fragment shader and used to draw many copies of a mesh at once """
         self.glid = None
+        self.uniforms, self.attributes, self.loc = {}, {}, Locations()
         vert = self._compile_shader(vertex_source, GL.GL_VERTEX_SHADER)
         frag = self._compile_shader(fragment_source, GL.GL_FRAGMENT_SHADER)
         if vert and frag:
@@ -48,28 +210,85 @@ class Shader:
             if not status:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 sys.exit(1)
+            self._introspect()
+
+            # shaders declaring the per-frame Camera block read it from the
+            # shared binding point, filled once per frame by the Viewer
+            block = GL.glGetUniformBlockIndex(self.glid, 'Camera')
+            if block != GL.GL_INVALID_INDEX:
+                GL.glUniformBlockBinding(self.glid, block, CameraBlock.binding)
+
+        self.instanced = None
+        if instanced_source:
+            self.instanced = Shader(instanced_source, fragment_source)
+
+    def _introspect(self):
+        """ Query active uniforms & attributes once, right after linking.
+            Tables map name -> (location, GL type, array size), and self.loc
+            is the location-only view shared by every mesh using the shader """
+        nb_uniforms = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)
+        for index in range(nb_uniforms):
+            name, size, gl_type = GL.glGetActiveUniform(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetUniformLocation(self.glid, name)
+            name = name[:-3] if name.endswith('[0]') else name  # array name
+            self.uniforms[name] = (location, gl_type, size)
+            if location >= 0:  # uniform block members have no location
+                self.loc[name] = location
+        nb_attributes = GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_ATTRIBUTES)
+        for index in range(nb_attributes):
+            name, size, gl_type = GL.glGetActiveAttrib(self.glid, index)
+            name = name.decode('ascii')
+            location = GL.glGetAttribLocation(self.glid, name)
+            self.attributes[name] = (location, gl_type, size)
 
     def __del__(self):
         GL.glUseProgram(0)
+        render_state.invalidate()
         if self.glid:                      # if this is a valid shader object
             GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
 
 
 class VertexArray:
     """ helper class to create and self destroy OpenGL vertex array objects."""
-    def __init__(self, attributes, index=None, usage=GL.GL_STATIC_DRAW):
+    instance_location = 4  # per-instance model matrix columns: locations 4-7
+
+    # narrowest index type able to address a vertex count: (limit, numpy, GL)
+    index_types = ((1 << 8, np.uint8, GL.GL_UNSIGNED_BYTE),
+                   (1 << 16, np.uint16, GL.GL_UNSIGNED_SHORT),
+                   (1 << 32, np.uint32, GL.GL_UNSIGNED_INT))
+    chunk_size = 21845  # triangles per 16 bit chunk: 3 * 21845 = 0xFFFF
+
+    def __init__(self, attributes, index=None, usage=GL.GL_STATIC_DRAW,
+                 interleaved=False, split=False, quantize=()):
         """ Vertex array from attributes and optional index array. Vertex
-            Attributes should be list of arrays with one row per vertex. """
+            Attributes should be list of arrays with one row per vertex.
+            Interleaved packs all attributes in a single strided buffer.
+            Indices use the narrowest type fitting the vertex count; with
+            split, triangle meshes too large for 16 bit indices are cut in
+            chunks with their own vertices, drawn with a base vertex each.
+            Quantize gives the compact encoding of each attribute, see
+            quantize(), and implies interleaved. """
+        self.bounds = None if attributes[0] is None else Bounds(attributes[0])
+        self.dequantize = None  # matrix from stored to mesh positions
+        interleaved = interleaved or bool(quantize)
+        chunks = None
+        if split and index is not None and np.max(index) >= 1 << 16:
+            attributes, index, chunks = self._split(attributes, index)
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        render_state.bind_vertex_array(self.glid)
         self.buffers = []  # we will store buffers in a list
         nb_primitives, size = 0, 0
 
+        if interleaved:
+            nb_primitives = self._upload_interleaved(attributes, usage,
+                                                     quantize)
+
         # load buffer per vertex attribute (in list with index = shader layout)
         for loc, data in enumerate(attributes):
-            if data is not None:
+            if data is not None and not interleaved:
                 # bind a new vbo, upload its data to GPU, declare size and type
                 self.buffers.append(GL.glGenBuffers(1))
                 data = np.array(data, np.float32, copy=False)  # ensure format
@@ -81,60 +300,496 @@ class VertexArray:
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
+        self.instanced_command = GL.glDrawArraysInstanced
         self.arguments = (0, nb_primitives)
+        self.count = nb_primitives  # vertices per draw, e.g. 3 per triangle
         if index is not None:
             self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            index = np.asarray(index)
+            limit = int(index.max()) + 1 if index.size else 0
+            _, index_type, gl_type = next(t for t in self.index_types
+                                          if limit <= t[0])
+            index_buffer = np.ascontiguousarray(index, index_type)
+            saved = 4 * index.size - index_buffer.nbytes  # vs 32 bit indices
+            memory_stats['index_bytes'] += index_buffer.nbytes
+            memory_stats['index_bytes_saved'] += saved
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
+            self.instanced_command = GL.glDrawElementsInstanced
+            self.arguments = (index_buffer.size, gl_type, None)
+            self.count = index_buffer.size
+            if chunks is not None:  # byte offsets of the narrowed indices
+                stride = index_buffer.itemsize
+                chunks = [(count, ctypes.c_void_p(first * stride), base)
+                          for count, first, base in chunks]
+                self.draw_command = self._draw_chunks
+                self.instanced_command = self._draw_chunks_instanced
+                self.arguments = (chunks, gl_type)
+        self.instance_buffer = None  # created on first instanced draw
+
+    @classmethod
+    def _split(cls, attributes, index):
+        """ cut triangle list in chunks of at most 0xFFFF indices, each with a
+            copy of the vertices it uses, so that every chunk is indexed with
+            16 bit local indices. Returns new attributes and index arrays, and
+            the chunk list of (index count, first index, base vertex) """
+        triangles = np.asarray(index).reshape(-1, 3)
+        pieces, local, chunks, base, first = [], [], [], 0, 0
+        for start in range(0, len(triangles), cls.chunk_size):
+            chunk = triangles[start:start + cls.chunk_size]
+            used, remap = np.unique(chunk, return_inverse=True)
+            pieces.append(used)
+            local.append(remap.reshape(chunk.shape))
+            chunks.append((chunk.size, first, base))
+            base, first = base + len(used), first + chunk.size
+        used = np.concatenate(pieces)
+        attributes = [None if data is None else np.asarray(data)[used]
+                      for data in attributes]
+        memory_stats['vertex_bytes_duplicated'] += sum(
+            data[0].nbytes * (len(used) - len(np.unique(used)))
+            for data in attributes if data is not None)
+        return attributes, np.concatenate(local), chunks
+
+    @staticmethod
+    def _draw_chunks(primitive, chunks, gl_type):
+        """ draw command of split meshes, one base vertex draw per chunk """
+        for count, offset, base in chunks:
+            GL.glDrawElementsBaseVertex(primitive, count, gl_type, offset,
+                                        base)
+
+    @staticmethod
+    def _draw_chunks_instanced(primitive, chunks, gl_type, nb_instances):
+        """ instanced counterpart of _draw_chunks """
+        for count, offset, base in chunks:
+            GL.glDrawElementsInstancedBaseVertex(primitive, count, gl_type,
+                                                 offset, nb_instances, base)
+
+    @staticmethod
+    def quantize(data, kind):
+        """ Compact encoding of an attribute array, read back by shaders as
+            usual through normalized attribute pointers. Kinds:
+            'position': normalized int16 xyz, padded to 4 for alignment, of
+                positions mapped to [-1, 1] by a uniform scale, so that the
+                returned dequantization matrix does not skew normals
+            'normal': unit vectors packed as GL_INT_2_10_10_10_REV
+            'normal8': unit vectors as snorm8 xyz, padded to 4
+            'uv': half floats
+            Returns encoded array and dequantization matrix, or None """
+        data = np.asarray(data, np.float32)
+        if kind == 'position':
+            bounds = Bounds(data)
+            scale = max(float(bounds.extent.max()), 1e-12)
+            encoded = np.zeros((len(data), 4), np.int16)
+            encoded[:, :3] = np.round((data - bounds.center) / scale * 32767)
+            dequantize = np.diag((scale, scale, scale, 1)).astype(np.float32)
+            dequantize[:3, 3] = bounds.center
+            return encoded, dequantize
+        if kind == 'uv':
+            return data.astype(np.float16), None
+        norms = np.linalg.norm(data, axis=1, keepdims=True)
+        unit = data / np.maximum(norms, 1e-12)
+        if kind == 'normal8':
+            encoded = np.zeros((len(data), 4), np.int8)
+            encoded[:, :3] = np.round(unit * 127)
+            return encoded, None
+        bits = np.round(unit * 511).astype(np.int32) & 0x3FF  # 10 bits each
+        return bits[:, 0] | bits[:, 1] << 10 | bits[:, 2] << 20, None
+
+    @staticmethod
+    def interleave(attributes, quantize=()):
+        """ structured array where each row holds a whole vertex: attribute
+            'loc' is field 'a<loc>', at its byte offset within the row, with
+            optional compact encodings given by kind per attribute.
+            Returns the array and the dequantization matrix, or None """
+        kinds = list(quantize) + [None] * len(attributes)
+        fields, dequantize, size = [], None, 0
+        for loc, (data, kind) in enumerate(zip(attributes, kinds)):
+            if data is None:
+                continue
+            data = np.asarray(data, np.float32)
+            size += data.nbytes
+            if kind:
+                data, matrix = VertexArray.quantize(data, kind)
+                dequantize = matrix if matrix is not None else dequantize
+            fields.append(('a%d' % loc, data))
+        layout = np.dtype([(name, data.dtype, data.shape[1:])
+                           for name, data in fields])
+        vertices = np.rec.fromarrays([data for _, data in fields], layout)
+        memory_stats['vertex_bytes'] += vertices.nbytes
+        memory_stats['vertex_bytes_saved'] += size - vertices.nbytes
+        return vertices, dequantize
+
+    @staticmethod
+    def _attribute_pointers(layout):
+        """ declare the fields of an interleaved layout to the bound vao,
+            reading from the currently bound array buffer. Integer fields
+            are normalized quantized data, see quantize() """
+        for name in layout.names:
+            field, offset = layout.fields[name][:2]
+            size, normalized = field.shape[0] if field.shape else 1, True
+            if field.base == np.float32:
+                gl_type, normalized = GL.GL_FLOAT, False
+            elif field.base == np.float16:
+                gl_type, normalized = GL.GL_HALF_FLOAT, False
+            elif field.base == np.int32:  # xyz packed in 4 components
+                size, gl_type = 4, GL.GL_INT_2_10_10_10_REV
+            else:  # xyz padded to 4 components
+                size = 3
+                gl_type = GL.GL_SHORT if field.base == np.int16 else GL.GL_BYTE
+            loc = int(name[1:])
+            GL.glEnableVertexAttribArray(loc)
+            GL.glVertexAttribPointer(loc, size, gl_type, normalized,
+                                     layout.itemsize, ctypes.c_void_p(offset))
+
+    def _upload_interleaved(self, attributes, usage, quantize=()):
+        """ one vbo holding all attributes, returns the vertex count """
+        vertices, self.dequantize = self.interleave(attributes, quantize)
+        self.buffers.append(GL.glGenBuffers(1))
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices.view(np.uint8), usage)
+        self._attribute_pointers(vertices.dtype)
+        return len(vertices)
 
-    def execute(self, primitive):
-        """ draw a vertex array, either as direct array or indexed array """
-        GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
+    def execute(self, primitive, instances=None):
+        """ draw a vertex array, either as direct array or indexed array,
+            once per model matrix of the optional (n, 4, 4) instances """
+        render_state.bind_vertex_array(self.glid)
+        frame_stats['draw_calls'] += 1
+        if instances is None:
+            self.draw_command(primitive, *self.arguments)
+        else:
+            self._upload_instances(instances)
+            self.instanced_command(primitive, *self.arguments, len(instances))
+            frame_stats['instances'] += len(instances)
+
+    def _upload_instances(self, models):
+        """ stream model matrices to the per-instance attribute buffer """
+        if self.instance_buffer is None:
+            self.instance_buffer = GL.glGenBuffers(1)
+            self.buffers.append(self.instance_buffer)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+            for column in range(4):  # a mat4 attribute takes 4 locations
+                loc = self.instance_location + column
+                GL.glEnableVertexAttribArray(loc)
+                GL.glVertexAttribPointer(loc, 4, GL.GL_FLOAT, False, 64,
+                                         ctypes.c_void_p(16 * column))
+                GL.glVertexAttribDivisor(loc, 1)
+
+        # row-major numpy matrices, transposed so that GLSL reads columns
+        columns = np.ascontiguousarray(models.transpose(0, 2, 1), np.float32)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.instance_buffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, columns, GL.GL_STREAM_DRAW)
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
+        render_state.invalidate()
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
 
 
+class GeometryArena:
+    """ Suballocates the vertices and indices of many meshes in a few large
+        buffers, one ArenaPool per interleaved vertex format, instead of one
+        vertex array object and two or three buffers per mesh. Returns range
+        handles usable wherever Mesh expects a VertexArray """
+    def __init__(self, capacity=1 << 16, usage=GL.GL_STATIC_DRAW):
+        self.pools = {}  # vertex layout dtype -> ArenaPool
+        self.capacity, self.usage = capacity, usage  # initial pool vertices
+
+    def add(self, attributes, index=None, quantize=()):
+        """ store attributes & optional index array, return an ArenaRange.
+            Quantize gives compact attribute encodings as in VertexArray """
+        vertices, dequantize = VertexArray.interleave(attributes, quantize)
+        pool = self.pools.get(vertices.dtype)
+        if pool is None:
+            pool = ArenaPool(vertices.dtype, self.capacity, self.usage)
+            self.pools[vertices.dtype] = pool
+        bounds = None if attributes[0] is None else Bounds(attributes[0])
+        vertex_range = pool.add(vertices, index, bounds)
+        vertex_range.dequantize = dequantize
+        return vertex_range
+
+    def add_levels(self, attributes, indices, quantize=()):
+        """ store attributes once with several index arrays, e.g. levels of
+            detail, return one ArenaRange per index array, sharing vertices """
+        first = self.add(attributes, indices[0], quantize)
+        return [first] + [first.pool.add_index(index, first)
+                          for index in indices[1:]]
+
+
+class ArenaPool(VertexArray):
+    """ One vertex array object with growable interleaved vertex buffer and
+        32 bit index buffer, shared by all the ranges allocated from it.
+        Ranges keep their byte offsets when buffers grow, as content is
+        copied to the bigger buffers on the GPU side """
+    def __init__(self, layout, capacity, usage):  # pylint: disable=W0231
+        self.glid = GL.glGenVertexArrays(1)
+        self.layout, self.usage = layout, usage
+        self.buffers = [None, None]  # vertex buffer, index buffer
+        self.sizes, self.ends = [0, 0], [0, 0]  # allocated & used bytes
+        self.instance_buffer = None  # created on first instanced draw
+        self._resize(0, capacity * layout.itemsize)
+        self._resize(1, capacity * 3 * 4)  # about one triangle per vertex
+
+    def _resize(self, which, size):
+        """ replace buffer 'which' by one of size bytes, keeping content """
+        old, new = self.buffers[which], GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_COPY_WRITE_BUFFER, new)
+        GL.glBufferData(GL.GL_COPY_WRITE_BUFFER, size, None, self.usage)
+        if old is not None:
+            GL.glBindBuffer(GL.GL_COPY_READ_BUFFER, old)
+            GL.glCopyBufferSubData(GL.GL_COPY_READ_BUFFER,
+                                   GL.GL_COPY_WRITE_BUFFER, 0, 0,
+                                   self.ends[which])
+            GL.glDeleteBuffers(1, [old])
+        memory_stats['arena_bytes'] += size - self.sizes[which]
+        self.buffers[which], self.sizes[which] = new, size
+
+        # attribute pointers & element buffer are vao state: attach new one
+        render_state.bind_vertex_array(self.glid)
+        if which == 0:
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, new)
+            self._attribute_pointers(self.layout)
+        else:
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, new)
+
+    def _reserve(self, which, nbytes):
+        """ grow buffer 'which' by doubling until nbytes more fit in it """
+        size = self.sizes[which]
+        while self.ends[which] + nbytes > size:
+            size *= 2
+        if size != self.sizes[which]:
+            self._resize(which, size)
+
+    def add(self, vertices, index=None, bounds=None):
+        """ append interleaved vertices and their indices, return range """
+        if index is None:  # draw arrays emulated by an identity index
+            index = np.arange(len(vertices), dtype=np.uint32)
+        self._reserve(0, vertices.nbytes)
+
+        render_state.bind_vertex_array(self.glid)
+        vertex_end = self.ends[0]
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[0])
+        GL.glBufferSubData(GL.GL_ARRAY_BUFFER, vertex_end, vertices.nbytes,
+                           vertices.view(np.uint8))
+        self.ends[0] = vertex_end + vertices.nbytes
+        vertices = ArenaRange(self, 0, 0, vertex_end // self.layout.itemsize,
+                              bounds)
+        return self.add_index(index, vertices)
+
+    def add_index(self, index, vertices):
+        """ append index array drawing the vertices of another range """
+        index = np.ascontiguousarray(index, np.uint32).ravel()
+        self._reserve(1, index.nbytes)
+        render_state.bind_vertex_array(self.glid)
+        index_end = self.ends[1]
+        GL.glBufferSubData(GL.GL_ELEMENT_ARRAY_BUFFER, index_end, index.nbytes,
+                           index)
+        self.ends[1] = index_end + index.nbytes
+        index_range = ArenaRange(self, index.size, index_end,
+                                 vertices.arguments[3], vertices.bounds)
+        index_range.dequantize = vertices.dequantize
+        return index_range
+
+
+class ArenaRange:
+    """ Mesh geometry stored in an ArenaPool, drawn like a VertexArray with
+        base vertex draw calls into the shared buffers """
+    def __init__(self, pool, count, offset, base_vertex, bounds=None):
+        self.pool, self.glid = pool, pool.glid  # pool kept alive by ranges
+        self.bounds, self.count = bounds, count
+        self.dequantize = None  # matrix from stored to mesh positions
+        self.arguments = (count, GL.GL_UNSIGNED_INT, ctypes.c_void_p(offset),
+                          base_vertex)
+
+    def execute(self, primitive, instances=None):
+        """ draw the range, once per model matrix of optional instances """
+        render_state.bind_vertex_array(self.glid)
+        frame_stats['draw_calls'] += 1
+        if instances is None:
+            GL.glDrawElementsBaseVertex(primitive, *self.arguments)
+        else:
+            self.pool._upload_instances(instances)  # pylint: disable=W0212
+            count, gl_type, offset, base_vertex = self.arguments
+            GL.glDrawElementsInstancedBaseVertex(primitive, count, gl_type,
+                                                 offset, len(instances),
+                                                 base_vertex)
+            frame_stats['instances'] += len(instances)
+
+
+class CameraBlock:
+    """ std140 uniform buffer holding the per-frame camera parameters, read
+        by every shader declaring the following uniform block:
+            layout(std140, row_major) uniform Camera {
+                mat4 view;
+                mat4 projection;
+                vec3 w_camera_position;
+            };
+    """
+    binding = 0  # uniform buffer binding point shared by all shaders
+
+    def __init__(self):
+        self.data = np.zeros(36, np.float32)  # 2 mat4 + vec3 padded to vec4
+        self.glid = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, self.data.nbytes, None,
+                        GL.GL_DYNAMIC_DRAW)
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, self.binding, self.glid)
+
+    def update(self, view, projection):
+        """ upload this frame's camera, once for all meshes and shaders """
+        self.data[0:16] = view.ravel()  # row_major layout: no transpose
+        self.data[16:32] = projection.ravel()
+        self.data[32:35] = np.linalg.inv(view)[:3, 3]  # world camera position
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, self.data.nbytes,
+                           self.data)
+
+    def __del__(self):  # object dies => kill GL buffer from GPU
+        GL.glDeleteBuffers(1, [self.glid])
+
+
 # ------------  Mesh is a core drawable, can be basis for most objects --------
 class Mesh:
-    """ Basic mesh class with attributes passed as constructor arguments """
+    """ Basic mesh class with attributes passed as constructor arguments,
+        either a list of per-vertex arrays, or an already built VertexArray """
     def __init__(self, shader, attributes, index=None):
         self.shader = shader
-        names = ['view', 'projection', 'model']
-        self.loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
-        self.vertex_array = VertexArray(attributes, index)
+        self.loc = shader.loc  # locations were looked up once at link time
+        if hasattr(attributes, 'execute'):  # e.g. interleaved VertexArray
+            self.vertex_array = attributes
+        else:
+            self.vertex_array = VertexArray(attributes, index)
+        self.bounds = getattr(self.vertex_array, 'bounds', None)  # culling
+        self.dequantize = getattr(self.vertex_array, 'dequantize', None)
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
-        GL.glUniformMatrix4fv(self.loc['view'], 1, True, view)
-        GL.glUniformMatrix4fv(self.loc['projection'], 1, True, projection)
+        # quantized positions are mapped back to the mesh frame by model
+        if self.dequantize is not None:
+            model = model @ self.dequantize
+
+        # view & projection come from the per-frame Camera uniform block
+        if model.ndim == 3:  # stack of per-instance model matrices
+            self.vertex_array.execute(primitives, instances=model)
+            return
         GL.glUniformMatrix4fv(self.loc['model'], 1, True, model)
 
         # draw triangle as GL_TRIANGLE vertex array, draw array call
         self.vertex_array.execute(primitives)
 
+    def draw_instanced(self, projection, view, models):
+        """ Draw one copy of the mesh per (n, 4, 4) model matrix in a single
+            call. The shader's instanced variant is swapped in during the call
+            so that subclass draw methods set their uniforms on it """
+        shader = self.shader
+        self.shader, self.loc = shader.instanced, shader.instanced.loc
+        try:
+            self.draw(projection, view, models)
+        finally:
+            self.shader, self.loc = shader, shader.loc
+
+    def state_key(self):
+        """ ids of the GL objects bound to draw: program, texture, vertex array
+            RenderQueue sorts on them to minimize state changes. Textures are
+            identified by their state_id if any, as streamed ones get a new
+            glid once loaded, after the queue keys were packed """
+        texture = getattr(self, 'texture', None)
+        texture = getattr(texture, 'state_id', texture.glid) if texture else 0
+        return (self.shader.glid, texture, self.vertex_array.glid)
+
 
 # ------------  Node is the core drawable for hierarchical scene graphs -------
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    generation = 0  # bumped on any structure change, see DrawList
+
     def __init__(self, children=(), transform=identity()):
+        self.worlds = {}  # id(parent matrix) -> (parent matrix, world matrix)
+        self.parents, self.children = [], []  # parent links for refits
+        self._bounds, self.refit_needed = None, True
+        self.add(*children)
         self.transform = transform
-        self.children = list(iter(children))
+
+    @property
+    def transform(self):
+        """ Local transform. Assign a new matrix to change it, the cached world
+            matrices of the subtree are only invalidated by this setter """
+        return self._transform
+
+    @transform.setter
+    def transform(self, matrix):
+        self._transform = matrix
+        self.invalidate()
+        self.refit()
+
+    def invalidate(self):
+        """ Mark cached world matrices of this whole subtree as dirty """
+        if self.worlds:  # children caches hang below ours, already clean else
+            self.worlds.clear()
+            for child in self.children:
+                if isinstance(child, Node):
+                    child.invalidate()
+
+    def refit(self):
+        """ Mark subtree bounds of this node and its ancestors out of date,
+            they are merged again on their next access only """
+        if not self.refit_needed:  # ancestors of a dirty node are dirty
+            self.refit_needed = True
+            for parent in self.parents:
+                parent.refit()
+
+    @property
+    def bounds(self):
+        """ Bounds of the whole subtree, in the parent frame of this node,
+            i.e. including its own transform, or None if some descendant is
+            unbounded. Clean children keep their merged bounds: a refit only
+            merges again the nodes on the path to the changed transform """
+        if self.refit_needed:
+            boxes = [getattr(child, 'bounds', None) for child in self.children]
+            if any(box is None for box in boxes):
+                self._bounds = None
+            else:  # an empty node bounds the point at its origin
+                boxes = boxes or [Bounds(np.zeros((1, 3)))]
+                self._bounds = Bounds.merge(boxes, self.transform)
+            self.refit_needed = False
+        return self._bounds
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
+        for child in drawables:
+            if isinstance(child, Node):
+                child.parents.append(self)
+        self.refit()
+        Node.generation += 1  # compiled draw lists are now out of date
+
+    def world(self, model):
+        """ World matrix of this node under parent matrix model. The product
+            is cached per parent matrix: a node shared by several parents
+            keeps one world matrix each, a static subtree costs no math. """
+        cached = self.worlds.get(id(model))
+        if cached is None:
+            if len(self.worlds) > 64:  # parent keeps passing fresh matrices
+                self.worlds.clear()
+            world = model @ self.transform
+            self.worlds[id(model)] = (model, world)  # keeps model id alive
+            frame_stats['matrices_computed'] += 1
+            return world
+        frame_stats['matrices_skipped'] += 1
+        return cached[1]
+
+    def animate(self):
+        """ Per frame update of the node, e.g. of an animated transform, run
+            by DrawList on every node before culling: state set in draw
+            would only change once the node is seen again """
 
     def draw(self, projection, view, model):
-        """ Recursive draw, passing down updated model matrix. """
+        """ Recursive draw, passing down updated model matrix """
+        world = self.world(model)
         for child in self.children:
-            child.draw(projection, view, model @ self.transform )  # TODO TP3: hierarchical update
+            child.draw(projection, view, world)
 
     def key_handler(self, key):
         """ Dispatch keyboard events to children """
@@ -143,6 +798,395 @@ class Node:
                 child.key_handler(key)
 
 
+class LODNode(Node):
+    """ Level of detail switch: children are versions of a same object from
+        finest to coarsest, only one is drawn, picked from the projected size
+        of the node bounds, i.e. bounding sphere radius over view distance
+        scaled by the projection, a fraction of the viewport half height """
+    def __init__(self, levels=(), sizes=(0.5, 0.25, 0.1),
+                 transform=identity()):
+        """ sizes: minimal projected size of each level but the last one """
+        super().__init__(levels, transform)
+        self.sizes = sizes
+
+    def level(self, projection, view, model):
+        """ index of the child to draw, given the camera & parent matrices """
+        bounds = self.bounds
+        if bounds is None or len(self.children) < 2:
+            return 0
+        center = view @ model @ np.append(bounds.center, 1)
+        scale = np.linalg.norm(model[:3, :3], axis=0).max()
+        distance = max(-center[2], 1e-6)  # camera looks down -z axis
+        size = scale * bounds.radius * projection[1, 1] / distance
+        level = sum(size < limit for limit in self.sizes)
+        return min(level, len(self.children) - 1)
+
+    def draw(self, projection, view, model):
+        """ Draw the child selected for this frame """
+        level = self.level(projection, view, model)
+        frame_stats['lod%d' % level] += 1
+        self.children[level].draw(projection, view, self.world(model))
+
+
+# ------------  Scene graph compiled to a flat draw list ---------------------
+class RenderQueue:
+    """ Draw items sorted on a packed 64 bit key, from most to least expensive
+        state change: shader (16 bits), texture (16), vertex array (16), then
+        front to back depth (16). Items can be kept while static, only their
+        depth is refreshed each frame, and sorting is a single NumPy argsort
+        over the key array so it stays cheap for tens of thousands of items.
+        Items are (drawable, slot) pairs, slot indexing world matrices """
+    def __init__(self, items=()):
+        self.items, self.slots = [], np.zeros(0, np.intp)
+        self.state = np.zeros(0, np.uint64)  # depth bits left at zero
+        self.extend(items)
+
+    def extend(self, items):
+        """ Add (drawable, slot) items, packing their state key bits once """
+        items = list(items)
+        state = [getattr(drawable, 'state_key', lambda: (0, 0, 0))()
+                 for drawable, _ in items]
+        state = np.array(state, np.uint64).reshape(-1, 3) & 0xFFFF
+        state = (state[:, 0] << 48) | (state[:, 1] << 32) | (state[:, 2] << 16)
+        self.items += items
+        slots = np.array([slot for _, slot in items], np.intp)
+        self.slots = np.append(self.slots, slots)
+        self.state = np.append(self.state, state)
+
+    def clear(self):
+        """ Drop all items, e.g. to collect a new set of dynamic items """
+        self.__init__()
+
+    def order(self, view, worlds):
+        """ Item indices sorted by state, then camera distance of their origin
+            given view matrix, and world matrices indexed by the item slots """
+        if not self.items:
+            return []
+        positions = worlds[self.slots, :3, 3]
+        depth = -(positions @ view[2, :3] + view[2, 3])  # -z in view space
+        near, far = depth.min(), depth.max()
+        depth = (depth - near) * (0xFFFF / max(far - near, 1e-6))
+        return np.argsort(self.state | depth.astype(np.uint64), kind='stable')
+
+
+class DrawList:
+    """ Node hierarchy flattened once into contiguous arrays: one world matrix
+        slot per plain Node, and one (drawable, slot, instances) record per
+        drawable, in depth-first order. Each frame is then a flat loop, instead
+        of one recursive call and one temporary matrix per edge. Drawables with
+        their own draw method, e.g. animated nodes, are kept as opaque records
+        drawn from their parent's slot. A mesh referenced by several nodes
+        gets a single record listing all its slots as instances, and is drawn
+        with one instanced call. Drawables with bounds are frustum culled,
+        instance by instance, with one vectorized test over all of them,
+        after a top-down pass on node subtree bounds skipping hidden subtrees
+        in one test each. Nodes overriding Node.animate are animated first.
+        Compile again when Node.generation moves. """
+    def __init__(self, root):
+        self.generation = Node.generation
+        self.nodes, self.parents, self.records = [], [], []
+        self.child_slots = []  # slot -> slots of its plain children
+        self._compile(root, -1)
+        self._batch_instances()
+        self.animated = [node for node in self._subtree(root)
+                         if type(node).animate is not Node.animate]
+
+        self.worlds = np.zeros((len(self.nodes), 4, 4), np.float32)
+        self.views = list(self.worlds)   # persistent per-slot matrix views
+        self.sources = [None] * len(self.nodes)  # transform each slot used
+        self.model = None                # root parent matrix used last frame
+        self.opaque = [(drawable, slot) for drawable, slot, _ in self.records
+                       if isinstance(drawable, Node)]
+        self.queue = RenderQueue((drawable, slot)  # static: keys packed once
+                                 for drawable, slot, _ in self.records)
+        self._gather_bounds()
+        self.occlusion = None  # OcclusionCuller, created on first use
+
+    def _compile(self, node, parent):
+        """ Depth-first flattening: slot for node, records for its leaves """
+        slot = len(self.nodes)
+        self.nodes.append(node)
+        self.parents.append(parent)
+        self.child_slots.append([])
+        if parent >= 0:
+            self.child_slots[parent].append(slot)
+        for child in node.children:
+            if type(child).draw is Node.draw:  # plain transform node, inline
+                self._compile(child, slot)
+            else:
+                self.records.append((child, slot, None))
+
+    @classmethod
+    def _subtree(cls, node):
+        """ Nodes of the subtree of node, opaque ones' descendants included """
+        yield node
+        for child in node.children:
+            if isinstance(child, Node):
+                yield from cls._subtree(child)
+
+    def _batch_instances(self):
+        """ Merge records of a same mesh reached through several nodes into
+            one (mesh, first slot, all slots) record, drawn instanced if its
+            shader has an instanced variant """
+        slots = {}
+        for drawable, slot, _ in self.records:
+            slots.setdefault(id(drawable), []).append(slot)
+        records, self.records = self.records, []
+        for drawable, slot, _ in records:
+            shared = slots[id(drawable)]
+            shader = getattr(drawable, 'shader', None)
+            if len(shared) < 2 or not getattr(shader, 'instanced', None):
+                self.records.append((drawable, slot, None))
+            elif slot == shared[0]:  # first occurrence stands for all
+                self.records.append((drawable, slot, np.array(shared)))
+
+    def _gather_bounds(self):
+        """ Stack local boxes of bounded drawables, one row per culled item:
+            the record itself, or each of its instances. Record i owns the
+            rows of slice self.spans[i], None if it has no bounds. Rows of
+            opaque nodes are refreshed each frame, as they may animate """
+        self.spans, slots, centers, extents, triangles = [], [], [], [], []
+        self.dynamic = []  # (row, opaque node)
+        for drawable, slot, instances in self.records:
+            bounds = getattr(drawable, 'bounds', None)
+            if bounds is None:
+                self.spans.append(None)
+                continue
+            shared = [slot] if instances is None else instances
+            if isinstance(drawable, Node):
+                self.dynamic.append((len(slots), drawable))
+            self.spans.append(slice(len(slots), len(slots) + len(shared)))
+            slots.extend(shared)
+            centers.extend([bounds.center] * len(shared))
+            extents.extend([bounds.extent] * len(shared))
+            vertex_array = getattr(drawable, 'vertex_array', None)
+            count = getattr(vertex_array, 'count', 0)
+            triangles.extend([count // 3] * len(shared))
+        self.bounded_slots = np.array(slots, np.intp)
+        self.triangles = np.array(triangles, np.intp)  # per row, for stats
+        self.centers = np.array(centers, np.float32).reshape(-1, 3)
+        self.extents = np.array(extents, np.float32).reshape(-1, 3)
+
+    def cull_subtrees(self, planes):
+        """ Top-down visibility of node slots, one vectorized test per tree
+            level on the subtree bounds of the frontier, whose hidden nodes
+            are not expanded: the visited part of the tree is what is seen.
+            The root covers the whole scene and is always expanded """
+        shown = np.zeros(len(self.nodes), bool)
+        shown[0], frontier = True, self.child_slots[0]
+        while frontier:
+            bounds = [self.nodes[slot].bounds for slot in frontier]
+            tested = [i for i, box in enumerate(bounds) if box is not None]
+            visible = np.ones(len(frontier), bool)
+            if tested:
+                parents = [self.parents[frontier[i]] for i in tested]
+                centers = np.array([bounds[i].center for i in tested])
+                extents = np.array([bounds[i].extent for i in tested])
+                visible[tested] = boxes_visible(planes, self.worlds[parents],
+                                                centers, extents)
+            frame_stats['subtrees_culled'] += len(frontier) - int(visible.sum())
+            frontier = [slot for slot, seen in zip(frontier, visible) if seen]
+            shown[frontier] = True
+            frontier = [child for slot in frontier
+                        for child in self.child_slots[slot]]
+        return shown
+
+    def cull(self, projection, view):
+        """ Visibility of each bounded item, tested only when its slot lies
+            in a visible subtree """
+        planes = frustum_planes(projection @ view)
+        for row, node in self.dynamic:
+            bounds = node.bounds
+            self.centers[row], self.extents[row] = bounds.center, bounds.extent
+        visible = self.cull_subtrees(planes)[self.bounded_slots]
+        tested = np.flatnonzero(visible)
+        visible[tested] = boxes_visible(planes,
+                                        self.worlds[self.bounded_slots[tested]],
+                                        self.centers[tested],
+                                        self.extents[tested])
+        return visible
+
+    def update(self, model):
+        """ Recompute world matrices of slots whose transform was replaced
+            since last frame, or whose parent slot was recomputed, once
+            animated nodes have updated their transforms """
+        for node in self.animated:
+            node.animate()
+        changed = [False] * len(self.nodes)
+        root_changed, self.model = model is not self.model, model
+        for slot, (node, parent) in enumerate(zip(self.nodes, self.parents)):
+            transform = node.transform
+            dirty = changed[parent] if parent >= 0 else root_changed
+            if dirty or transform is not self.sources[slot]:
+                parent_world = self.worlds[parent] if parent >= 0 else model
+                self.worlds[slot] = parent_world @ transform
+                self.sources[slot] = transform
+                changed[slot] = True
+                frame_stats['matrices_computed'] += 1
+            else:
+                frame_stats['matrices_skipped'] += 1
+
+        # opaque nodes cache world matrices keyed on our in-place slot views
+        for drawable, slot in self.opaque:
+            if changed[slot]:
+                drawable.invalidate()
+
+    def draw(self, projection, view, model, occlusion=False):
+        """ Update world matrices, then draw all records in a flat loop,
+            sorted by GL state first and front to back depth second. With
+            occlusion, items found hidden by last frame's queries are skipped
+            and queries are issued for this frame's items in the frustum """
+        self.update(model)
+        visible = self.cull(projection, view)
+        frame_stats['culled'] += len(visible) - int(visible.sum())
+        if not occlusion:
+            self.occlusion = None
+        elif self.occlusion is None:
+            self.occlusion = OcclusionCuller(len(visible))
+        if self.occlusion:
+            in_frustum = visible
+            occluded = self.occlusion.occluded(in_frustum) & in_frustum
+            frame_stats['occluded'] += int(occluded.sum())
+            saved = self.triangles[occluded].sum()
+            frame_stats['triangles_saved'] += int(saved)
+            visible = in_frustum & ~occluded
+        views, records = self.views, self.records
+        for index in self.queue.order(view, self.worlds):
+            drawable, slot, instances = records[index]
+            span = self.spans[index]
+            if span is not None:
+                shown = visible[span]
+                if not shown.any():
+                    continue
+                if instances is not None:
+                    instances = instances[shown]
+            frame_stats['drawn'] += 1 if instances is None else len(instances)
+            if instances is None:
+                drawable.draw(projection, view, views[slot])
+            else:
+                models = self.worlds[instances]
+                drawable.draw_instanced(projection, view, models)
+
+        if self.occlusion:
+            rows = np.flatnonzero(in_frustum)
+            worlds = self.worlds[self.bounded_slots[rows]]
+            centers, extents = world_boxes(worlds, self.centers[rows],
+                                           self.extents[rows])
+            camera = np.linalg.inv(view)[:3, 3]
+            self.occlusion.query(rows, centers, extents, camera)
+
+
+class OcclusionCuller:
+    """ Hardware occlusion queries on the bounding boxes of draw list items.
+        Once the scene is drawn, the world box of each item in the frustum is
+        drawn without color nor depth writes inside a GL_ANY_SAMPLES_PASSED
+        query. Results are read on the next frame, only when available, so
+        the CPU never waits on the GPU. An item is skipped after hysteresis
+        consecutive occluded results, and drawn again on its first visible
+        result, so that objects do not flicker at the occluder edges """
+    hysteresis = 3  # consecutive occluded results before skipping an item
+
+    vertex_source = """#version 330 core
+layout(location = 0) in vec3 position;
+uniform mat4 model;
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+void main() {
+    gl_Position = projection * view * model * vec4(position, 1);
+}"""
+    fragment_source = """#version 330 core
+out vec4 out_color;
+void main() {
+    out_color = vec4(1);
+}"""
+    box_index = (0, 1, 3, 0, 3, 2, 4, 5, 7, 4, 7, 6,   # x = -1, x = 1 faces
+                 0, 1, 5, 0, 5, 4, 2, 3, 7, 2, 7, 6,   # y = -1, y = 1 faces
+                 0, 2, 6, 0, 6, 4, 1, 3, 7, 1, 7, 5)   # z = -1, z = 1 faces
+
+    def __init__(self, size):
+        """ queries & state for the size items of a DrawList """
+        self.queries = np.array(GL.glGenQueries(size) if size else [],
+                                np.uint32, ndmin=1)
+        self.pending = np.zeros(size, bool)  # issued, result not read yet
+        self.occluded_frames = np.zeros(size, np.intp)
+        self.shader = Shader(self.vertex_source, self.fragment_source)
+        corners = Bounds(np.array(((-1, -1, -1), (1, 1, 1)))).corners()
+        self.box = VertexArray([corners], self.box_index)
+
+    def occluded(self, in_frustum):
+        """ Read last frame results still pending, return the mask of items
+            to skip this frame. Items out of the frustum forget their state,
+            to be drawn as soon as they get back in """
+        for row in np.flatnonzero(self.pending):
+            query = self.queries[row]
+            if not GL.glGetQueryObjectuiv(query, GL.GL_QUERY_RESULT_AVAILABLE):
+                continue  # GPU not done yet, keep previous state
+            passed = GL.glGetQueryObjectuiv(query, GL.GL_QUERY_RESULT)
+            frames = self.occluded_frames[row]
+            self.occluded_frames[row] = 0 if passed else frames + 1
+            self.pending[row] = False
+        self.occluded_frames[~in_frustum] = 0
+        return self.occluded_frames >= self.hysteresis
+
+    def query(self, rows, centers, extents, camera):
+        """ Issue queries for items rows, given their world boxes, when their
+            previous query was read. Boxes are slightly enlarged to not depth
+            fight with the mesh they enclose, and an item whose box contains
+            the camera is visible: its faces may be clipped by the near plane
+        """
+        extents = extents * 1.01 + 1e-3
+        inside = np.all(np.abs(camera - centers) <= 1.1 * extents, axis=1)
+        self.occluded_frames[rows[inside]] = 0
+
+        GL.glColorMask(False, False, False, False)
+        GL.glDepthMask(False)
+        # back faces count from inside too, culling restored as it was
+        culling = render_state.enable(GL.GL_CULL_FACE, False)
+        render_state.use_program(self.shader.glid)
+        model = np.identity(4, np.float32)
+        for row, center, extent in zip(rows[~inside], centers[~inside],
+                                       extents[~inside]):
+            if self.pending[row]:
+                continue
+            model[[0, 1, 2], [0, 1, 2]], model[:3, 3] = extent, center
+            GL.glUniformMatrix4fv(self.shader.loc['model'], 1, True, model)
+            GL.glBeginQuery(GL.GL_ANY_SAMPLES_PASSED, self.queries[row])
+            self.box.execute(GL.GL_TRIANGLES)
+            GL.glEndQuery(GL.GL_ANY_SAMPLES_PASSED)
+            self.pending[row] = True
+            frame_stats['occlusion_queries'] += 1
+        render_state.enable(GL.GL_CULL_FACE, culling)
+        GL.glDepthMask(True)
+        GL.glColorMask(True, True, True, True)
+
+    def __del__(self):  # object dies => destroy GL queries
+        if len(self.queries):
+            GL.glDeleteQueries(len(self.queries), self.queries)
+
+
+# ------------  parallel asset loading --------------------------------------
+def load_parallel(prepare, files, *args, workers=None):
+    """ Run prepare(file, *args) for each file in a pool of worker processes,
+        yielding (file, result) pairs as soon as each one finishes, so that
+        loading takes about as long as the slowest file. prepare must not
+        touch OpenGL: GL objects are created by the caller, on the main
+        thread which owns the context, as results come in """
+    files = list(files)
+    if len(files) < 2:  # not worth starting a pool
+        for file in files:
+            yield file, prepare(file, *args)
+        return
+    # spawned workers do not inherit the GL context & window of this process
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = {pool.submit(prepare, file, *args): file for file in files}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
 # ------------  Viewer class & window management ------------------------------
 class Viewer(Node):
     """ GLFW viewer window, with classic initialization & graphics loop """
@@ -161,8 +1205,9 @@ class Viewer(Node):
         # make win's OpenGL context current; no OpenGL calls can happen before
         glfw.make_context_current(self.win)
 
-        # initialize trackball
+        # initialize trackball, and camera uniform buffer shared by shaders
         self.trackball = Trackball()
+        self.camera = CameraBlock()
         self.mouse = (0, 0)
 
         # register event handlers
@@ -178,12 +1223,20 @@ class Viewer(Node):
 
         # initialize GL by setting viewport and default render characteristics
         GL.glClearColor(0.1, 0.1, 0.1, 0.1)
-        GL.glEnable(GL.GL_CULL_FACE)   # backface culling enabled (TP2)
-        GL.glEnable(GL.GL_DEPTH_TEST)  # depth test now enabled (TP2)
+        render_state.enable(GL.GL_CULL_FACE)   # backface culling (TP2)
+        render_state.enable(GL.GL_DEPTH_TEST)  # depth test (TP2)
 
         # cyclic iterator to easily toggle polygon rendering modes
         self.fill_modes = cycle([GL.GL_LINE, GL.GL_POINT, GL.GL_FILL])
 
+        # render statistics of the last frame, printed with the 'I' key
+        self.stats = {}
+
+        # root matrix kept from frame to frame so world caches stay valid
+        self.model = identity()
+        self.draw_list = None  # compiled scene, rebuilt on structure change
+        self.occlusion = False  # occlusion culling mode, toggled with 'O'
+
     def run(self):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
@@ -193,9 +1246,19 @@ class Viewer(Node):
             win_size = glfw.get_window_size(self.win)
             view = self.trackball.view_matrix()
             projection = self.trackball.projection_matrix(win_size)
+            self.camera.update(view, projection)
+
+            # per-frame work of other modules, e.g. streamed texture uploads
+            frame_tasks[:] = [task for task in frame_tasks if task()]
+
+            # draw our scene objects, from the flattened scene graph
+            if getattr(self.draw_list, 'generation', None) != Node.generation:
+                self.draw_list = DrawList(self)
+            self.draw_list.draw(projection, view, self.model, self.occlusion)
 
-            # draw our scene objects
-            self.draw(projection, view, identity())
+            # collect this frame's render statistics for the next one
+            self.stats = dict(frame_stats)
+            frame_stats.clear()
 
             # flush render commands, and swap draw buffers
             glfw.swap_buffers(self.win)
@@ -204,12 +1267,21 @@ class Viewer(Node):
             glfw.poll_events()
 
     def on_key(self, _win, key, _scancode, action, _mods):
-        """ 'Q' or 'Escape' quits """
+        """ 'Q' or 'Escape' quits, 'I' prints last frame's statistics,
+            'O' toggles occlusion culling """
         if action == glfw.PRESS or action == glfw.REPEAT:
             if key == glfw.KEY_ESCAPE or key == glfw.KEY_Q:
                 glfw.set_window_should_close(self.win, True)
             if key == glfw.KEY_W:
                 GL.glPolygonMode(GL.GL_FRONT_AND_BACK, next(self.fill_modes))
+            if key == glfw.KEY_O:
+                self.occlusion = not self.occlusion
+                print('Occlusion culling', 'on' if self.occlusion else 'off')
+            if key == glfw.KEY_I:
+                stats = sorted(self.stats.items())
+                print(', '.join('%s: %d' % stat for stat in stats))
+                stats = sorted(memory_stats.items())
+                print(', '.join('%s: %d' % stat for stat in stats))
 
             # call Node.key_handler which calls key_handlers for all drawables
             self.key_handler(key)
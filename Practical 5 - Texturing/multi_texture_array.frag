@@ -0,0 +1,10 @@
+#version 330 core
+
+uniform sampler2DArray diffuse_map;
+in vec2 frag_uv;
+flat in float frag_layer;
+out vec4 out_color;
+
+void main() {
+    out_color = texture(diffuse_map, vec3(frag_uv, frag_layer));
+}
@@ -0,0 +1,20 @@
+#version 330 core
+
+uniform mat4 model;
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+layout(location = 0) in vec3 position;
+layout (location = 1) in vec2 uvs;
+layout (location = 2) in float layer;  // texture array layer of the material
+
+out vec2 frag_uv;
+flat out float frag_layer;
+
+void main() {
+    gl_Position = projection * view * model * vec4(position, 1);
+    frag_uv = vec2(uvs.x, uvs.y);
+    frag_layer = layer;
+}
@@ -1,8 +1,11 @@
 #version 330 core
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 layout(location = 0) in vec3 position;
 
 out vec2 frag_tex_coords;
@@ -0,0 +1,18 @@
+#version 330 core
+
+// model matrix given per instance, one column per location 4 to 7
+layout(location = 4) in mat4 model;
+layout(std140, row_major) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+layout(location = 0) in vec3 position;
+
+out vec2 frag_tex_coords;
+out vec2 frag_uv;
+
+void main() {
+    gl_Position = projection * view * model * vec4(position, 1);
+    frag_tex_coords = position.xy;
+}
@@ -13,37 +13,14 @@ import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
-from core import Shader, Mesh, Node, Viewer
+from core import Shader, Mesh, Node, Viewer, VertexArray, GeometryArena
+from core import LODNode, render_state
 from transform import rotate
+import meshopt                      # mesh simplification & its disk cache
+import meshcache                    # binary cache of imported scenes
 
-from PIL import Image               # load images for textures
-from itertools import cycle
-
-
-# -------------- OpenGL Texture Wrapper ---------------------------------------
-class Texture:
-    """ Helper class to create and automatically destroy textures """
-    def __init__(self, tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
-                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
-        self.glid = GL.glGenTextures(1)
-        try:
-            # imports image as a numpy array in exactly right format
-            tex = np.asarray(Image.open(tex_file).convert('RGBA'))
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
-            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
-                            tex.shape[0], 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, min_filter)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-            message = 'Loaded texture %s\t(%s, %s, %s, %s)'
-            print(message % (tex_file, tex.shape, wrap_mode, min_filter, mag_filter))
-        except FileNotFoundError:
-            print("ERROR: unable to load texture file %s" % tex_file)
-
-    def __del__(self):  # delete GL texture from GPU when object dies
-        GL.glDeleteTextures(self.glid)
+from texture import textures, samplers  # shared textures & sampling
+from texture import TextureArray    # material textures as array layers
 
 
 # -------------- Example texture plane class ----------------------------------
@@ -57,9 +34,6 @@ class TexturedPlane(Mesh):
         faces = np.array(((0, 1, 2), (0, 2, 3)), np.uint32)
         super().__init__(shader, [vertices], faces)
 
-        loc = GL.glGetUniformLocation(shader.glid, 'diffuse_map')
-        self.loc['diffuse_map'] = loc
-
         # interactive toggles
         self.wrap = cycle([GL.GL_REPEAT, GL.GL_MIRRORED_REPEAT,
                            GL.GL_CLAMP_TO_BORDER, GL.GL_CLAMP_TO_EDGE])
@@ -69,25 +43,26 @@ class TexturedPlane(Mesh):
         self.wrap_mode, self.filter_mode = next(self.wrap), next(self.filter)
         self.tex_file = tex_file
 
-        # setup texture and upload it to GPU
-        self.texture = Texture(tex_file, self.wrap_mode, *self.filter_mode)
+        # setup texture and upload it to GPU, once: toggles switch samplers
+        self.texture = textures.get(tex_file)
+        self.sampler = samplers.get(self.wrap_mode, *self.filter_mode)
 
     def key_handler(self, key):
         # some interactive elements
         if key == glfw.KEY_F6:
             self.wrap_mode = next(self.wrap)
-            self.texture = Texture(self.tex_file, self.wrap_mode, *self.filter_mode)
+            self.sampler = samplers.get(self.wrap_mode, *self.filter_mode)
         if key == glfw.KEY_F7:
             self.filter_mode = next(self.filter)
-            self.texture = Texture(self.tex_file, self.wrap_mode, *self.filter_mode)
+            self.sampler = samplers.get(self.wrap_mode, *self.filter_mode)
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
+        # texture access setups, only issued when the state changes
+        render_state.bind_texture(self.texture.glid, unit=0)
+        render_state.bind_sampler(self.sampler.glid, unit=0)
+        render_state.uniform1i(self.loc['diffuse_map'], 0)
         super().draw(projection, view, model, primitives)
 
 
@@ -97,34 +72,37 @@ class TexturedMesh(Mesh):
     def __init__(self, shader, tex, attributes, faces):
         super().__init__(shader, attributes, faces)
 
-        loc = GL.glGetUniformLocation(shader.glid, 'diffuse_map')
-        self.loc['diffuse_map'] = loc
-
         # setup texture and upload it to GPU
         self.texture = tex
+        self.sampler = samplers.get()  # default sampling of textures
 
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
+        # texture access setups, only issued when the state changes
+        render_state.bind_texture(self.texture.glid, unit=0,
+                                  target=self.texture.target)
+        render_state.bind_sampler(self.sampler.glid, unit=0)
+        render_state.uniform1i(self.loc['diffuse_map'], 0)
         super().draw(projection, view, model, primitives)
 
-        # leave clean state for easier debugging
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glUseProgram(0)
 
 
-
-def load_textured(file, shader, tex_file=None):
-    """ load resources from file using assimp, return list of TexturedMesh """
+def load_textured(file, shader, tex_file=None, arena=None, lod=False,
+                  optimize=False, weld=True, quantize=False,
+                  asynchronous=False):
+    """ load resources from file using assimp, return list of TexturedMesh.
+        With lod, each mesh is a LODNode of simplified versions sharing its
+        vertices, simplification being cached on disk next to the file.
+        Optimize reorders triangles and vertices for GPU cache locality,
+        after weld has merged duplicate vertices. Quantize stores half float
+        uvs; positions stay float as texture.vert maps textures from them.
+        Asynchronous textures are decoded & uploaded while rendering """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = meshcache.load_scene(file, flags)  # cached import
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
@@ -144,28 +122,57 @@ def load_textured(file, shader, tex_file=None):
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
             tex_file = found[0]
         if tex_file:
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file)
+            mat.properties['diffuse_map'] = textures.get(
+                tex_file=tex_file, asynchronous=asynchronous)
+
+    geometry = [([mesh.mVertices, mesh.mTextureCoords[0]], mesh.mFaces)
+                for mesh in scene.mMeshes]
+    if weld:  # duplicate vertices, as assimp does not join them
+        geometry = meshopt.weld_geometry(file, geometry)
+    if optimize:  # cached reordering, also printing cache statistics
+        geometry = meshopt.optimize_geometry(file, geometry)
+    if lod:  # index arrays of each level, all levels sharing one arena
+        lods = meshopt.load_lods(file, [(attributes[0], faces)
+                                        for attributes, faces in geometry])
+        arena = arena or GeometryArena()
+    quantize = (None, 'uv') if quantize else ()
 
     # prepare textured mesh
     meshes = []
-    for mesh in scene.mMeshes:
+    for index, mesh in enumerate(scene.mMeshes):
         mat = scene.mMaterials[mesh.mMaterialIndex].properties
         assert mat['diffuse_map'], "Trying to map using a textureless material"
-        attributes = [mesh.mVertices, mesh.mTextureCoords[0]]
-        mesh = TexturedMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces)
-        meshes.append(mesh)
+        attributes, faces = geometry[index]
+        if lod:
+            levels = arena.add_levels(attributes, lods[index], quantize)
+        elif arena:  # range of the shared GeometryArena buffers
+            levels = [arena.add(attributes, faces, quantize)]
+        else:
+            levels = [VertexArray(attributes, faces, interleaved=True,
+                                  quantize=quantize)]
+        levels = [TexturedMesh(shader, mat['diffuse_map'], level, None)
+                  for level in levels]
+        meshes.append(LODNode(levels) if lod else levels[0])
 
     size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
     return meshes
 
 
-def multi_load_textured(file, shader, tex_file=None):
-    """ load resources from file using assimp, return list of TexturedMesh """
+def multi_load_textured(file, shader, tex_file=None, arena=None,
+                        quantize=False, asynchronous=False,
+                        texture_array=False):
+    """ load resources from file using assimp, return list of TexturedMesh.
+        Quantize stores int16 positions and half float uvs, 12 bytes per
+        vertex instead of 20. Asynchronous textures are decoded & uploaded
+        while rendering, the scene showing up at once. With texture_array,
+        material textures are layers of one TextureArray, and all meshes
+        are merged into a single one, drawn at once with a shader reading
+        the layer of each vertex as attribute 2, see multi_texture_array """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = meshcache.load_scene(file, flags)  # cached import
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
         return []
@@ -184,17 +191,41 @@ def multi_load_textured(file, shader, tex_file=None):
                      if name.startswith(f) or f.startswith(name)]
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
             tex_file = found[0]
-        if tex_file:
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file[index])
+        if tex_file and not texture_array:
+            mat.properties['diffuse_map'] = textures.get(
+                tex_file=tex_file[index], asynchronous=asynchronous)
 
     # prepare textured mesh
     meshes = []
-    for mesh in scene.mMeshes:
-        mat = scene.mMaterials[mesh.mMaterialIndex].properties
-        assert mat['diffuse_map'], "Trying to map using a textureless material"
-        attributes = [mesh.mVertices, mesh.mTextureCoords[0]]
-        mesh = TexturedMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces)
-        meshes.append(mesh)
+    quantize = ('position', 'uv') if quantize else ()
+    if texture_array:  # one mesh, each vertex with its material's layer
+        assert tex_file, "Trying to map using a textureless material"
+        diffuse_map = TextureArray(tex_file[:len(scene.mMaterials)],
+                                   asynchronous=asynchronous)
+        geometry = [([mesh.mVertices, mesh.mTextureCoords[0],
+                      np.full(len(mesh.mVertices), mesh.mMaterialIndex,
+                              np.float32)], mesh.mFaces)
+                    for mesh in scene.mMeshes]
+        attributes, faces = meshopt.merge(geometry)
+        if arena:  # range of the shared GeometryArena buffers
+            attributes = arena.add(attributes, faces, quantize)
+        else:
+            attributes = VertexArray(attributes, faces, interleaved=True,
+                                     quantize=quantize)
+        meshes.append(TexturedMesh(shader, diffuse_map, attributes, None))
+    else:
+        for mesh in scene.mMeshes:
+            mat = scene.mMaterials[mesh.mMaterialIndex].properties
+            assert mat['diffuse_map'], \
+                "Trying to map using a textureless material"
+            attributes = [mesh.mVertices, mesh.mTextureCoords[0]]
+            if arena:  # range of the shared GeometryArena buffers
+                attributes = arena.add(attributes, mesh.mFaces, quantize)
+            else:
+                attributes = VertexArray(attributes, mesh.mFaces,
+                                         interleaved=True, quantize=quantize)
+            mesh = TexturedMesh(shader, mat['diffuse_map'], attributes, None)
+            meshes.append(mesh)
 
     size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
@@ -212,14 +243,8 @@ class PhongMesh(Mesh):
         self.light_dir = light_dir
         self.k_a, self.k_d, self.k_s, self.s = k_a, k_d, k_s, s
 
-        # retrieve OpenGL locations of shader variables at initialization
-        names = ['light_dir', 'k_a', 's', 'k_s', 'k_d', 'w_camera_position']
-
-        loc = {n: GL.glGetUniformLocation(shader.glid, n) for n in names}
-        self.loc.update(loc)
-
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
         # setup light parameters
         GL.glUniform3fv(self.loc['light_dir'], 1, self.light_dir)
@@ -230,9 +255,8 @@ class PhongMesh(Mesh):
         GL.glUniform3fv(self.loc['k_s'], 1, self.k_s)
         GL.glUniform1f(self.loc['s'], max(self.s, 0.001))
 
-        # world camera position for Phong illumination specular component
-        w_camera_position = np.linalg.inv(view)[:,3]
-        GL.glUniform3fv(self.loc['w_camera_position'], 1, w_camera_position)
+        # world camera position for the specular component comes from the
+        # per-frame Camera uniform block, no inverse view needed per mesh
 
         super().draw(projection, view, model, primitives)
 
@@ -242,7 +266,7 @@ class PhongMesh(Mesh):
 def main():
     """ create a window, add scene objects, then run rendering loop """
     viewer = Viewer()
-    shader = Shader("texture.vert", "texture.frag")
+    shader = Shader("texture.vert", "texture.frag", "texture_instanced.vert")
 
     # node = Node(transform=rotate((0, 0, 1), 45))
     # viewer.add(node)
@@ -271,14 +295,30 @@ def main():
     # viewer.add(*[mesh for file in sys.argv[1:] for mesh in load_textured(file, shader=shader)])
 
 
-    # Load castle's multiple textures one by one
-    multi_shader = Shader("multi_texture.vert", "multi_texture.frag")
+    # Load castle's multiple textures one by one, or with the optional
+    # loading modes given on the command line, each usable on its own:
+    #   --arena          meshes share the buffers of a single arena
+    #   --quantize       int16 positions & half float uvs
+    #   --async          textures streamed while rendering
+    #   --texture-array  textures as layers of one array texture, meshes
+    #                    merged in one drawn at once
+    texture_array = '--texture-array' in sys.argv
+    if texture_array:  # shaders reading the layer of each vertex
+        multi_shader = Shader("multi_texture_array.vert",
+                              "multi_texture_array.frag")
+    else:
+        multi_shader = Shader("multi_texture.vert", "multi_texture.frag")
     text_list = ["resources/castle/Texture/Castle Exterior Texture.jpg",
                 "resources/castle/Texture/Towers Doors and Windows Texture.jpg",
                 "resources/castle/Texture/Ground and Fountain Texture.jpg",
                 "resources/castle/Texture/Castle Interior Texture.jpg"]
 
-    castle_mesh_list = multi_load_textured(file="resources/castle/CastleFBX.fbx", shader=multi_shader, tex_file=text_list)
+    castle_mesh_list = multi_load_textured(
+        file="resources/castle/CastleFBX.fbx", shader=multi_shader,
+        tex_file=text_list,
+        arena=GeometryArena() if '--arena' in sys.argv else None,
+        quantize='--quantize' in sys.argv,
+        asynchronous='--async' in sys.argv, texture_array=texture_array)
     for mesh in castle_mesh_list:
         viewer.add(mesh)
 
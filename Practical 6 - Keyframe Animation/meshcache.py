@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Binary disk cache of imported asset scenes, skipping assimp parsing on later
+runs: mesh arrays are saved as .npy files read back as memory maps, material
+properties as JSON. Entries are keyed on asset path, modification time, size
+and post-processing flags, and least recently used ones are evicted past a
+total size limit.
+Can be run on asset files to fill the cache offline, or with --clear.
+"""
+# Python built-in modules
+import hashlib              # digest of asset path & state for cache keys
+import json                 # material properties & mesh layout of an entry
+import os                   # os function, i.e. checking file status
+import shutil               # removal of whole cache entries
+import sys                  # command line arguments
+
+# external, non built-in modules
+import numpy as np          # mesh arrays are saved & memory mapped by numpy
+import assimpcy             # 3D resource loader, on cache misses
+
+
+CACHE_DIR = os.environ.get('MESH_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.meshcache'))
+CACHE_LIMIT = int(os.environ.get('MESH_CACHE_LIMIT', 512 << 20))  # bytes
+VERSION = 1  # bump when the entry layout changes, invalidating all entries
+
+
+# ------------  assimp-like scene, as read back from the cache ---------------
+class CachedMaterial:
+    """ material with a properties dict, like assimp materials """
+    def __init__(self, properties):
+        self.properties = properties
+
+
+class CachedMesh:
+    """ mesh exposing the assimp mesh fields used by the loaders, arrays
+        being read only memory maps of the cache files """
+    def __init__(self, material_index, arrays):
+        self.mMaterialIndex = material_index
+        self.mVertices = arrays['vertices']
+        self.mNormals = arrays.get('normals')
+        self.mTextureCoords = [arrays[name] for name in sorted(arrays)
+                               if name.startswith('uv')]
+        self.mFaces = arrays['faces']
+        self.mNumVertices = len(self.mVertices)
+        self.mNumFaces = len(self.mFaces)
+
+
+class CachedScene:
+    """ scene with mMeshes & mMaterials lists, like assimp scenes """
+    def __init__(self, meshes, materials):
+        self.mMeshes, self.mMaterials = meshes, materials
+        self.mNumMeshes = len(meshes)
+        self.mNumMaterials = len(materials)
+
+
+# ------------  cache entries -------------------------------------------------
+def entry_path(file, flags):
+    """ cache entry directory: a digest of asset path and import flags,
+        shared by all versions of the asset, then one of its current state """
+    stat, file = os.stat(file), os.path.abspath(file)
+    prefix = hashlib.sha1(repr((file, int(flags))).encode()).hexdigest()[:16]
+    state = repr((VERSION, stat.st_mtime_ns, stat.st_size))
+    key = hashlib.sha1(state.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, '%s-%s' % (prefix, key))
+
+
+def _property(value):
+    """ JSON compatible version of an assimp material property value """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode(errors='replace')
+    return value
+
+
+def _array(value):
+    """ numeric JSON lists back to the arrays assimp gives """
+    if isinstance(value, list) and all(isinstance(item, (int, float))
+                                       for item in value):
+        return np.array(value, np.float32)
+    return value
+
+
+def write_entry(path, scene):
+    """ save the scene meshes & materials in a new entry directory, written
+        aside then renamed so that readers never see a partial entry """
+    layout = {'meshes': [], 'materials': []}
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    os.makedirs(temporary, exist_ok=True)
+    for index, mesh in enumerate(scene.mMeshes):
+        arrays = {'vertices': mesh.mVertices, 'normals': mesh.mNormals,
+                  'faces': mesh.mFaces}
+        arrays.update(('uv%d' % channel, uvs) for channel, uvs
+                      in enumerate(mesh.mTextureCoords or ()))
+        names = [name for name, array in arrays.items() if array is not None]
+        for name in names:
+            np.save(os.path.join(temporary, 'm%d_%s.npy' % (index, name)),
+                    np.ascontiguousarray(arrays[name]))
+        layout['meshes'].append({'material': int(mesh.mMaterialIndex),
+                                 'arrays': names})
+    for material in scene.mMaterials:
+        properties = {}
+        for name, value in material.properties.items():
+            try:  # keep only what JSON can represent
+                value = json.loads(json.dumps(_property(value)))
+                properties[str(name)] = value
+            except (TypeError, ValueError):
+                pass
+        layout['materials'].append(properties)
+    with open(os.path.join(temporary, 'scene.json'), 'w') as file:
+        json.dump(layout, file)
+    try:
+        os.rename(temporary, path)
+    except OSError:  # written meanwhile by another process: keep theirs
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def read_entry(path):
+    """ scene of an entry directory, arrays memory mapped, None if absent """
+    try:
+        with open(os.path.join(path, 'scene.json')) as file:
+            layout = json.load(file)
+        meshes = [CachedMesh(mesh['material'], {
+            name: np.load(os.path.join(path, 'm%d_%s.npy' % (index, name)),
+                          mmap_mode='r') for name in mesh['arrays']})
+                  for index, mesh in enumerate(layout['meshes'])]
+    except (OSError, KeyError, ValueError):
+        return None  # no entry, or unreadable one: import again
+    materials = [CachedMaterial({name: _array(value)
+                                 for name, value in properties.items()})
+                 for properties in layout['materials']]
+    try:  # recency for eviction, best effort on read only caches
+        os.utime(os.path.join(path, 'scene.json'))
+    except OSError:
+        pass
+    return CachedScene(meshes, materials)
+
+
+def entry_size(path):
+    """ bytes used by the files of an entry directory """
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+def evict(keep=(), limit=None):
+    """ remove stale versions of the kept entries' assets, then least
+        recently used entries until the cache fits in its size limit """
+    limit = CACHE_LIMIT if limit is None else limit
+    prefixes = {os.path.basename(path).split('-')[0] for path in keep}
+    keep = {os.path.abspath(path) for path in keep}
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        path = os.path.abspath(entry.path)
+        if path in keep or not entry.is_dir() or entry.name.endswith('.tmp'):
+            continue
+        if entry.name.split('-')[0] in prefixes:  # asset changed since
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            used = os.stat(os.path.join(path, 'scene.json')).st_mtime
+        except OSError:
+            used = 0  # incomplete entry, evicted first
+        entries.append((used, path))
+    total = sum(entry_size(path) for path in keep) + sum(
+        entry_size(path) for _, path in entries)
+    for _, path in sorted(entries):
+        if total <= limit:
+            break
+        total -= entry_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_scene(file, flags):
+    """ Drop-in for assimpcy.aiImportFile(file, flags), reading the scene
+        from the cache when up to date, else importing it with assimp and
+        caching it. Import errors are raised as assimp's own """
+    try:
+        path = entry_path(file, flags)
+    except OSError:  # missing asset, reported by assimp as usual
+        return assimpcy.aiImportFile(file, flags)
+    scene = read_entry(path)
+    if scene is None:
+        scene = assimpcy.aiImportFile(file, flags)
+        try:
+            write_entry(path, scene)
+            evict(keep=(path,))
+        except OSError as error:
+            print('WARNING: cannot write mesh cache', path, error)
+            return scene
+        scene = read_entry(path) or scene  # arrays as memory maps
+    return scene
+
+
+def clear():
+    """ remove all cache entries """
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+# -------------- command line filling or clearing the cache ------------------
+def main():
+    """ cache the asset files given on command line, for both import flags
+        used by the viewer loaders, or clear the cache with --clear """
+    if '--clear' in sys.argv:
+        clear()
+        return
+    if len(sys.argv) < 2:
+        print('Usage:\n\t%s [--clear] [3dfile]*\n\n3dfile\t\t the filename of'
+              ' a model in format supported by assimp.' % (sys.argv[0],))
+    pp = assimpcy.aiPostProcessSteps
+    for file in sys.argv[1:]:
+        for flags in (pp.aiProcess_Triangulate | pp.aiProcess_GenSmoothNormals,
+                      pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs):
+            scene = load_scene(file, flags)
+            print('Cached %s\t(%d meshes)' % (file, len(scene.mMeshes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Mesh optimization tools working on numpy vertex & triangle index arrays:
+vertex welding, level of detail generation by quadric error edge collapse,
+and vertex cache & fetch locality reordering, with disk caches next to the
+asset files.
+Can be run on asset files to build their caches offline.
+"""
+# Python built-in modules
+import hashlib              # digest of mesh data for cache keys
+import os                   # os function, i.e. checking file status
+import sys                  # command line arguments
+import threading            # worker ids for temporary cache files
+import zipfile              # errors of truncated caches
+
+# external module
+import numpy as np          # all mesh processing is vectorized numpy
+
+
+LOD_RATIOS = (1 / 2, 1 / 4, 1 / 8)  # triangle counts of LOD levels after 0
+
+
+# Quadric error metric simplification ----------------------------------------
+def plane_quadrics(planes, weights):
+    """ 4x4 quadrics of (a, b, c, d) planes, squared distance to the plane of
+        homogeneous point v being v.Q.v, scaled by weights """
+    return weights[:, None, None] * planes[:, :, None] * planes[:, None, :]
+
+
+def vertex_quadrics(positions, triangles, boundary_weight=100.):
+    """ Per vertex sum of the area weighted quadrics of its triangle planes.
+        Border edges add a plane orthogonal to their triangle, heavily
+        weighted so that open borders keep their shape """
+    corners = positions[triangles]                         # (n, 3, 3)
+    normals = np.cross(corners[:, 1] - corners[:, 0],
+                       corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    normals /= np.maximum(areas, 1e-12)[:, None]
+    offsets = -(normals * corners[:, 0]).sum(axis=1, keepdims=True)
+    planes = np.hstack([normals, offsets])
+    quadrics = np.zeros((len(positions), 4, 4))
+    face_quadrics = plane_quadrics(planes, areas / 2)
+    for corner in range(3):
+        np.add.at(quadrics, triangles[:, corner], face_quadrics)
+
+    # border edges: undirected edges used by a single triangle
+    starts, ends = triangles.ravel(), triangles[:, [1, 2, 0]].ravel()
+    keys = np.minimum(starts, ends) * len(positions) + np.maximum(starts, ends)
+    _, inverse, counts = np.unique(keys, return_inverse=True,
+                                   return_counts=True)
+    border = np.flatnonzero(counts[inverse] == 1)
+    if len(border):
+        edges = positions[ends[border]] - positions[starts[border]]
+        sides = np.cross(edges, normals[border // 3])
+        lengths = np.linalg.norm(sides, axis=1)
+        sides /= np.maximum(lengths, 1e-12)[:, None]
+        offsets = -(sides * positions[starts[border]]).sum(axis=1)
+        side_quadrics = plane_quadrics(np.hstack([sides, offsets[:, None]]),
+                                       boundary_weight * lengths)
+        np.add.at(quadrics, starts[border], side_quadrics)
+        np.add.at(quadrics, ends[border], side_quadrics)
+    return quadrics
+
+
+def quadric_error(quadrics, points):
+    """ v.Q.v for n quadrics and n points in homogeneous coordinates """
+    points = np.hstack([points, np.ones((len(points), 1))])
+    return np.einsum('ni,nij,nj->n', points, quadrics, points)
+
+
+def simplify(positions, triangles, targets):
+    """ Quadric error edge collapse of a triangle mesh, returning one index
+        array per target triangle count, all indexing the same positions:
+        each collapse moves an edge onto its endpoint of least error.
+        Each pass collapses at once an independent set of cheap edges, those
+        of least cost around both their vertices, until a target is met """
+    positions = np.asarray(positions, np.float64).reshape(-1, 3)
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    quadrics = vertex_quadrics(positions, triangles)
+    levels, targets = [], sorted(targets, reverse=True)
+    while targets:
+        if len(triangles) <= targets[0]:
+            levels.append(triangles.copy())
+            targets.pop(0)
+            continue
+
+        # unique undirected edges, collapsed towards their best endpoint
+        starts, ends = triangles.ravel(), triangles[:, [1, 2, 0]].ravel()
+        keys = np.unique(np.minimum(starts, ends) * len(positions)
+                         + np.maximum(starts, ends))
+        first, second = keys // len(positions), keys % len(positions)
+        edge_quadrics = quadrics[first] + quadrics[second]
+        cost_first = quadric_error(edge_quadrics, positions[first])
+        cost_second = quadric_error(edge_quadrics, positions[second])
+        to_first = cost_first <= cost_second
+        keep = np.where(to_first, first, second)
+        drop = np.where(to_first, second, first)
+        cost = np.minimum(cost_first, cost_second)
+
+        # independent set: edges ranked first around both their vertices
+        rank = np.empty(len(cost), np.int64)
+        rank[np.argsort(cost, kind='stable')] = np.arange(len(cost))
+        best = np.full(len(positions), len(cost))
+        np.minimum.at(best, first, rank)
+        np.minimum.at(best, second, rank)
+        chosen = np.flatnonzero((best[first] == rank) & (best[second] == rank))
+        needed = (len(triangles) - targets[0] + 1) // 2  # ~2 per collapse
+        chosen = chosen[np.argsort(rank[chosen])[:max(needed, 1)]]
+        if not len(chosen):  # nothing left to collapse: keep what we have
+            levels += [triangles.copy() for _ in targets]
+            break
+
+        remap = np.arange(len(positions))
+        remap[drop[chosen]] = keep[chosen]
+        quadrics[keep[chosen]] += quadrics[drop[chosen]]
+        triangles = remap[triangles]
+        triangles = triangles[(triangles[:, 0] != triangles[:, 1]) &
+                              (triangles[:, 1] != triangles[:, 2]) &
+                              (triangles[:, 2] != triangles[:, 0])]
+    return levels
+
+
+def build_lods(positions, triangles, ratios=LOD_RATIOS):
+    """ LOD index arrays of a mesh: its own triangles, then simplified ones
+        keeping the given ratios of the triangle count """
+    triangles = np.asarray(triangles, np.uint32).reshape(-1, 3)
+    targets = [max(int(len(triangles) * ratio), 1) for ratio in ratios]
+    levels = simplify(positions, triangles, targets)
+    return [triangles] + [level.astype(np.uint32) for level in levels]
+
+
+# Vertex welding ---------------------------------------------------------------
+def weld(attributes, triangles, epsilon=0.):
+    """ Merge vertices whose attribute tuples are equal, or equal once
+        quantized on an epsilon grid, each attribute row of a vertex being
+        hashed as one opaque value by numpy unique on a void view of the
+        packed attributes. Returns compacted attribute arrays, in order of
+        first occurrence, triangles indexing them, and removed vertex count.
+        Note: values on both sides of a grid step are not merged """
+    arrays = [np.asarray(data, np.float32).reshape(len(data), -1)
+              for data in attributes]
+    keys = np.hstack(arrays) + np.float32(0)  # -0. and 0. hash the same
+    if epsilon:
+        keys = np.round(keys / epsilon).astype(np.int64)
+    keys = np.ascontiguousarray(keys)
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1])))
+    _, first, inverse = np.unique(rows.ravel(), return_index=True,
+                                  return_inverse=True)
+    order = np.argsort(first)  # unique sorts keys, restore first use order
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    triangles = remap[inverse.ravel()][np.asarray(triangles, np.int64)]
+    attributes = [np.asarray(data)[first[order]] for data in attributes]
+    return attributes, triangles, len(keys) - len(first)
+
+
+def weld_geometry(file, geometry, epsilon=0.):
+    """ weld on a list of (attributes, triangles) meshes of an asset file,
+        logging how many vertices were removed """
+    welded = [weld(attributes, triangles, epsilon)
+              for attributes, triangles in geometry]
+    removed = sum(count for _, _, count in welded)
+    total = sum(len(attributes[0]) for attributes, _ in geometry)
+    print('Welded %s\t(%d of %d vertices removed)' % (file, removed, total))
+    return [(attributes, triangles) for attributes, triangles, _ in welded]
+
+
+def merge(geometry):
+    """ single (attributes, triangles) mesh of a list of meshes with the same
+        attributes, triangle indices being offset to the merged vertices """
+    offsets = np.cumsum([0] + [len(attributes[0])
+                               for attributes, _ in geometry])
+    attributes = [np.concatenate(arrays) for arrays
+                  in zip(*(attributes for attributes, _ in geometry))]
+    triangles = np.concatenate([np.asarray(triangles, np.int64) + offset
+                                for (_, triangles), offset
+                                in zip(geometry, offsets)])
+    return attributes, triangles
+
+
+# Vertex cache optimization --------------------------------------------------
+def optimize_vertex_cache(triangles, nb_vertices, cache_size=32):
+    """ Tom Forsyth's linear speed vertex cache optimization: triangles are
+        emitted greedily, best score first, a triangle score summing those
+        of its vertices, which favor vertices recently used, i.e. still in
+        a simulated LRU cache, and vertices with few triangles left, so that
+        they are finished early. Only triangles of vertices whose score
+        changed are scored again after each emission """
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    if not len(triangles):
+        return triangles
+
+    # triangles using each vertex, as lists to remove emitted ones cheaply
+    counts = np.bincount(triangles.ravel(), minlength=nb_vertices)
+    order = np.argsort(triangles.ravel(), kind='stable') // 3
+    adjacency = [part.tolist() for part in
+                 np.split(order, np.cumsum(counts)[:-1])]
+
+    # score tables, by LRU cache position and by remaining triangle count
+    cache_score = [0.75] * 3 + [(1 - (i - 3) / (cache_size - 3)) ** 1.5
+                                for i in range(3, cache_size)]
+    valence_score = [0.] + [2 * n ** -0.5 for n in range(1, counts.max() + 1)]
+
+    remaining = counts.tolist()
+    vertex_score = [valence_score[n] for n in remaining]
+    tris = triangles.tolist()
+    emitted, result, cache = [False] * len(tris), [], []
+    best = max(range(len(tris)), key=lambda t: sum(vertex_score[v]
+                                                   for v in tris[t]))
+    unemitted = 0  # fallback scan position when the cache runs dry
+    for _ in range(len(tris)):
+        if best < 0:
+            while emitted[unemitted]:
+                unemitted += 1
+            best = unemitted
+        triangle = tris[best]
+        emitted[best] = True
+        result.append(best)
+        for vertex in triangle:
+            remaining[vertex] -= 1
+            adjacency[vertex].remove(best)
+
+        # move emitted vertices at the front of the LRU cache, rescore
+        cache = triangle + [v for v in cache if v not in triangle]
+        touched = set()
+        for position, vertex in enumerate(cache):
+            score = cache_score[position] if position < cache_size else 0.
+            vertex_score[vertex] = score + valence_score[remaining[vertex]]
+            touched.update(adjacency[vertex])
+        cache = cache[:cache_size]
+
+        best, best_score = -1, -1.
+        for t in touched:
+            a, b, c = tris[t]
+            score = vertex_score[a] + vertex_score[b] + vertex_score[c]
+            if score > best_score:
+                best, best_score = t, score
+    return triangles[result]
+
+
+def optimize_vertex_fetch(triangles, nb_vertices):
+    """ Renumber vertices in order of first use by triangles, so that vertex
+        fetches walk the vertex buffer forward. Returns new triangles, and
+        the permutation giving new attribute arrays as attribute[permutation]
+        Unused vertices are moved at the end """
+    triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+    used, first = np.unique(triangles.ravel(), return_index=True)
+    permutation = used[np.argsort(first)]
+    unused = np.setdiff1d(np.arange(nb_vertices), used)
+    permutation = np.concatenate([permutation, unused])
+    remap = np.empty(nb_vertices, np.int64)
+    remap[permutation] = np.arange(nb_vertices)
+    return remap[triangles], permutation
+
+
+def optimize(positions, triangles, cache_size=32):
+    """ Vertex cache then vertex fetch optimization of a mesh, returns its
+        reordered triangles and the vertex permutation to apply """
+    triangles = optimize_vertex_cache(triangles, len(positions), cache_size)
+    triangles, permutation = optimize_vertex_fetch(triangles, len(positions))
+    return [triangles.astype(np.uint32), permutation]
+
+
+def cache_stats(triangles, cache_size=16):
+    """ Average cache miss ratio (misses per triangle) and average transform
+        to vertex ratio (misses per used vertex) of triangles, simulating a
+        FIFO post-transform cache as found in most GPUs. Optimal ACMR is 0.5,
+        ATVR is 1 """
+    indices = np.asarray(triangles).ravel().tolist()
+    if not indices:
+        return 0., 0.
+    fifo, cached, misses = [], set(), 0
+    for vertex in indices:
+        if vertex not in cached:
+            misses += 1
+            fifo.append(vertex)
+            cached.add(vertex)
+            if len(fifo) > cache_size:
+                cached.discard(fifo.pop(0))
+    return misses / (len(indices) / 3), misses / len(set(indices))
+
+
+# Disk caches -----------------------------------------------------------------
+def cache_key(file, meshes, *parameters):
+    """ cache validity key: asset modification time, size, digest of the
+        input meshes data, and processing parameters """
+    stat, digest = os.stat(file), hashlib.sha1()
+    for positions, triangles in meshes:
+        digest.update(np.ascontiguousarray(positions, np.float32).tobytes())
+        digest.update(np.ascontiguousarray(triangles, np.int64).tobytes())
+    return np.array(repr((stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+                         + parameters))
+
+
+def cached(file, kind, meshes, parameters, build):
+    """ List of arrays build(positions, triangles) of each mesh of an asset
+        file, read from the file.kind.npz cache next to the asset when up to
+        date, else computed then saved for the next run. Returns the lists,
+        and whether they were computed """
+    cache, key = '%s.%s.npz' % (file, kind), cache_key(file, meshes,
+                                                      *parameters)
+    try:
+        with np.load(cache) as archive:
+            if archive['key'] == key:
+                return [[archive['m%d_%d' % (index, item)]
+                         for item in range(count)]
+                        for index, count in enumerate(archive['counts'])], False
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass  # no cache, or unreadable one: compute again
+
+    results = [build(positions, triangles) for positions, triangles in meshes]
+    arrays = {'m%d_%d' % (index, item): array
+              for index, result in enumerate(results)
+              for item, array in enumerate(result)}
+    # written aside then renamed, so that readers never see a partial file
+    temporary = '%s.%d.%d.tmp' % (cache, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary, 'wb') as archive:
+            np.savez(archive, key=key,
+                     counts=[len(result) for result in results], **arrays)
+        os.replace(temporary, cache)
+    except OSError as error:
+        print('WARNING: cannot write cache', cache, error)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return results, True
+
+
+def load_lods(file, meshes, ratios=LOD_RATIOS):
+    """ LOD index arrays of each (positions, triangles) mesh of an asset file,
+        cached next to the asset """
+    lods, built = cached(file, 'lod', meshes, ratios,
+                         lambda positions, triangles:
+                         build_lods(positions, triangles, ratios))
+    if built:
+        sizes = ', '.join('/'.join(str(len(level)) for level in levels)
+                          for levels in lods)
+        print('Simplified %s\t(%s triangles)' % (file, sizes))
+    return lods
+
+
+def load_optimized(file, meshes, cache_size=32):
+    """ Optimized (triangles, vertex permutation) of each (positions,
+        triangles) mesh of an asset file, cached next to the asset. Prints
+        the FIFO cache statistics before and after when computed """
+    results, built = cached(file, 'vcache', meshes, (cache_size,),
+                            lambda positions, triangles:
+                            optimize(positions, triangles, cache_size))
+    if built:
+        before = [cache_stats(triangles) for _, triangles in meshes]
+        after = [cache_stats(triangles) for triangles, _ in results]
+        for index, (old, new) in enumerate(zip(before, after)):
+            print('Optimized %s mesh %d\t(ACMR %.3f -> %.3f, ATVR %.3f -> %.3f)'
+                  % (file, index, old[0], new[0], old[1], new[1]))
+    return [tuple(result) for result in results]
+
+
+def optimize_geometry(file, geometry, cache_size=32):
+    """ load_optimized on a list of (attributes, triangles) meshes of file,
+        positions being the first of their attribute arrays. Returns the
+        same list with reordered attribute arrays and triangles """
+    optimized = load_optimized(file, [(attributes[0], triangles)
+                                      for attributes, triangles in geometry],
+                               cache_size)
+    return [([np.asarray(data)[permutation] for data in attributes], triangles)
+            for (attributes, _), (triangles, permutation)
+            in zip(geometry, optimized)]
+
+
+# Command line: build caches offline ------------------------------------------
+def main():
+    """ build the caches of asset files given on command line, for meshes
+        prepared like the viewer loaders do: welded on positions and normals,
+        or positions and texture coordinates with --uvs """
+    import assimpcy  # only needed to read assets from the command line
+    import meshcache
+    uvs = '--uvs' in sys.argv
+    files = [arg for arg in sys.argv[1:] if arg != '--uvs']
+    if not files:
+        print('Usage:\n\t%s [--uvs] [3dfile]*\n\n3dfile\t\t the filename of a'
+              ' model in format supported by assimp.' % (sys.argv[0],))
+    pp = assimpcy.aiPostProcessSteps
+    flags = pp.aiProcess_Triangulate | (pp.aiProcess_FlipUVs if uvs else
+                                        pp.aiProcess_GenSmoothNormals)
+    for file in files:
+        scene = meshcache.load_scene(file, flags)
+        geometry = [([mesh.mVertices, mesh.mTextureCoords[0] if uvs else
+                      mesh.mNormals], mesh.mFaces) for mesh in scene.mMeshes]
+        geometry = optimize_geometry(file, weld_geometry(file, geometry))
+        load_lods(file, [(attributes[0], triangles)
+                         for attributes, triangles in geometry])
+
+
+if __name__ == '__main__':
+    main()
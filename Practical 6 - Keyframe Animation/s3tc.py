@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+S3TC block compression of texture images in numpy, all 4x4 texel blocks of
+an image being encoded at once: BC1 (DXT1) for RGB images, 8 bytes a block,
+BC3 (DXT5) for RGBA ones, 16 bytes a block, i.e. 8x and 4x smaller than
+RGBA8 texels. Endpoints lie on the principal axis of each block's colors.
+Can be run on image files to fill their compressed mip caches offline.
+"""
+# Python built-in modules
+import sys                          # command line arguments
+
+# External, non built-in modules
+import numpy as np                  # all blocks are encoded as arrays
+
+
+BLOCK_BYTES = {3: 8, 4: 16}         # image channels -> bytes of a 4x4 block
+COLOR_CODES = np.array([0, 2, 3, 1])                # steps from c0 to c1
+ALPHA_CODES = np.array([0, 2, 3, 4, 5, 6, 7, 1])    # steps from a0 to a1
+
+
+def blocks(image):
+    """ (rows, columns, 16, channels) float 4x4 texel blocks of an image,
+        texels in row order, edges repeated up to multiples of 4 """
+    height, width = image.shape[:2]
+    image = np.pad(image, ((0, -height % 4), (0, -width % 4), (0, 0)),
+                   mode='edge').astype(np.float32)
+    rows, columns = image.shape[0] // 4, image.shape[1] // 4
+    image = image.reshape(rows, 4, columns, 4, image.shape[2])
+    return image.swapaxes(1, 2).reshape(rows, columns, 16, image.shape[-1])
+
+
+def to_rgb565(colors):
+    """ 16 bit 5:6:5 codes of float 0..255 RGB colors """
+    bits = np.round(np.clip(colors, 0, 255) * (np.array([31, 63, 31]) / 255))
+    bits = bits.astype(np.uint16)
+    return (bits[..., 0] << 11) | (bits[..., 1] << 5) | bits[..., 2]
+
+
+def from_rgb565(codes):
+    """ float RGB colors of 5:6:5 codes, low bits replicated as GPUs do """
+    red, green, blue = codes >> 11, (codes >> 5) & 63, codes & 31
+    return np.stack([(red << 3) | (red >> 2), (green << 2) | (green >> 4),
+                     (blue << 3) | (blue >> 2)], -1).astype(np.float32)
+
+
+def color_blocks(texels):
+    """ BC1 color blocks of (..., 16, 3) float texels: two 5:6:5 endpoints,
+        c0 > c1 for 4 color blocks, then 2 bit palette indices """
+    mean = texels.mean(-2, keepdims=True)
+    centered = texels - mean
+    covariance = np.einsum('...ki,...kj->...ij', centered, centered)
+    axis = texels.max(-2) - texels.min(-2)
+    for _ in range(4):  # power iterations from the bounding box diagonal
+        axis = np.einsum('...ij,...j->...i', covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=-1, keepdims=True), 1e-6)
+    projection = np.einsum('...ki,...i->...k', centered, axis)
+    ends = [mean[..., 0, :] + projection.max(-1)[..., None] * axis,
+            mean[..., 0, :] + projection.min(-1)[..., None] * axis]
+    c0, c1 = to_rgb565(ends[0]), to_rgb565(ends[1])
+    c0, c1 = np.maximum(c0, c1), np.minimum(c0, c1)
+
+    # palette index of each texel, from its position between the endpoints
+    e0, e1 = from_rgb565(c0)[..., None, :], from_rgb565(c1)[..., None, :]
+    span = e1 - e0
+    length = np.maximum(np.einsum('...ki,...ki->...k', span, span), 1e-6)
+    t = np.einsum('...ki,...ki->...k', texels - e0, span) / length
+    codes = COLOR_CODES[np.round(np.clip(t, 0, 1) * 3).astype(int)]
+    codes[c0 == c1] = 0
+    indices = (codes.astype(np.uint32) << (2 * np.arange(16, dtype=np.uint32)))
+    indices = np.bitwise_or.reduce(indices, -1)
+    return np.concatenate([np.stack([c0, c1], -1).astype('<u2').view(np.uint8),
+                           indices.astype('<u4')[..., None].view(np.uint8)],
+                          -1)
+
+
+def alpha_blocks(alpha):
+    """ BC3 alpha blocks of (..., 16) float alphas: a0 > a1 endpoints for
+        8 alpha blocks, then 3 bit palette indices """
+    a0, a1 = alpha.max(-1), alpha.min(-1)
+    t = (a0[..., None] - alpha) / np.maximum(a0 - a1, 1)[..., None]
+    codes = ALPHA_CODES[np.round(np.clip(t, 0, 1) * 7).astype(int)]
+    codes[a0 == a1] = 0
+    indices = (codes.astype(np.uint64) << (3 * np.arange(16, dtype=np.uint64)))
+    indices = np.bitwise_or.reduce(indices, -1)
+    return np.concatenate([np.stack([a0, a1], -1).astype(np.uint8),
+                           indices.astype('<u8')[..., None].view(np.uint8)
+                           [..., :6]], -1)
+
+
+def encode(image):
+    """ (rows, columns, 8 or 16) uint8 S3TC blocks of an RGB or RGBA uint8
+        image: BC1 for 3 channels, BC3 for 4 """
+    texels = blocks(image)
+    color = color_blocks(texels[..., :3])
+    if image.shape[2] == 3:
+        return color
+    return np.concatenate([alpha_blocks(texels[..., 3]), color], -1)
+
+
+# -------------- command line filling the compressed caches ------------------
+def main():
+    """ build the compressed mip caches of the image files on command line """
+    if len(sys.argv) < 2:
+        print('Usage:\n\t%s [image]*\n\nimage\t\t an image file used as '
+              'texture.' % (sys.argv[0],))
+    from texture import load_mips  # imports us, for its own uploads
+    for tex_file in sys.argv[1:]:
+        levels = load_mips(tex_file, compressed=True)
+        print('Compressed %s\t(%s, %d levels, %d bytes)' % (
+            tex_file, levels.shape, len(levels.levels),
+            sum(level.nbytes for level in levels.levels)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests of the meshopt disk caches, run with pytest from this directory.
+"""
+# external, non built-in modules
+import numpy as np          # mesh arrays
+
+import meshopt
+
+
+def grid_mesh(size=6):
+    """ (positions, triangles) of a flat size x size vertex grid """
+    x, y = np.meshgrid(np.arange(size), np.arange(size))
+    positions = np.stack([x.ravel(), y.ravel(), np.zeros(size * size)], -1)
+    corners = (y * size + x)[:-1, :-1].ravel()
+    triangles = np.concatenate([
+        np.stack([corners, corners + 1, corners + size], -1),
+        np.stack([corners + 1, corners + size + 1, corners + size], -1)])
+    return positions.astype(np.float32), triangles
+
+
+def test_truncated_vertex_cache_is_rebuilt(tmp_path):
+    """ a cache cut short, e.g. by an interrupted run, is a cache miss """
+    asset = tmp_path / 'grid.obj'
+    asset.write_text('# grid\n')
+    positions, triangles = grid_mesh()
+    geometry = [([positions], triangles)]
+
+    expected = meshopt.optimize_geometry(str(asset), geometry)
+    cache = tmp_path / 'grid.obj.vcache.npz'
+    data = cache.read_bytes()
+    cache.write_bytes(data[:len(data) // 2])
+
+    optimized = meshopt.optimize_geometry(str(asset), geometry)
+    assert np.array_equal(optimized[0][1], expected[0][1])
+    assert np.array_equal(optimized[0][0][0], expected[0][0][0])
+    with np.load(cache) as archive:  # written again, whole
+        assert archive['key'].size == 1
+    assert [path.name for path in tmp_path.iterdir()
+            if path.name.endswith('.tmp')] == []
@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+OpenGL texture wrapper, uploaded either at once, or asynchronously: decoded
+by worker threads then streamed to the GPU through pixel buffer objects a
+band of rows per frame, a placeholder being bound meanwhile. Full mip chains
+are built once and cached on disk next to the images, later runs uploading
+them straight from memory maps, S3TC block compressed when the GL context
+supports it. Textures are shared by file & sampling
+through the textures cache. Sampler objects set wrap & filter modes apart
+from the immutable textures.
+"""
+# Python built-in modules
+import ctypes                       # byte offsets into OpenGL buffers
+import itertools                    # texture ids stable across uploads
+import os                           # os function, i.e. checking file status
+import threading                    # worker ids for temporary cache files
+from concurrent.futures import ThreadPoolExecutor
+
+# External, non built-in modules
+import OpenGL.GL as GL              # standard Python OpenGL wrapper
+import numpy as np                  # all matrix manipulations & OpenGL args
+from PIL import Image               # load images for textures
+from OpenGL.GL.EXT.texture_compression_s3tc import (
+    glInitTextureCompressionS3TcEXT, GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT)
+
+import s3tc                         # block compression of the mip levels
+from core import render_state, frame_stats, frame_tasks, memory_stats
+
+
+PLACEHOLDER = np.full((1, 1, 4), (128, 128, 128, 255), np.uint8)  # grey
+FORMATS = {3: (GL.GL_RGB8, GL.GL_RGB),  # channels -> GL internal, pixel format
+           4: (GL.GL_RGBA8, GL.GL_RGBA)}
+COMPRESSED = {3: (GL_COMPRESSED_RGB_S3TC_DXT1_EXT, 0.5),  # BC1, texel bytes
+              4: (GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, 1)}   # BC3
+COMPRESSION = os.environ.get('TEXTURE_COMPRESSION', '1') != '0'
+GAMMA = 2.2        # color channels are averaged in linear light
+MIPS_VERSION = 1   # bump when the mip cache layout changes
+MIPS_HEADER = 48   # bytes of version, file mtime & size, height, width, depth
+
+
+def decode_image(tex_file, reduce=False):
+    """ RGBA numpy array of an image file, ready for glTexImage2D, or RGB
+        with reduce when the image has no alpha """
+    image = Image.open(tex_file)
+    alpha = 'A' in image.getbands() or 'transparency' in image.info
+    return np.asarray(image.convert('RGB' if reduce and not alpha else 'RGBA'))
+
+
+# -------------- mip chains & their disk cache -------------------------------
+def halve(images, axis):
+    """ floor half size of float images along axis, averaging texel pairs,
+        or the last three texels for an odd size, as GL mip levels expect """
+    size = images.shape[axis]
+    if size == 1:
+        return images
+    data = np.moveaxis(images, axis, 0)
+    half = (data[0:size - 1:2] + data[1:size:2]) / 2
+    if size % 2:
+        half[-1] = (2 * half[-1] + data[-1]) / 3
+    return np.moveaxis(half, 0, axis)
+
+
+def build_mips(image):
+    """ Full mip chain of a uint8 (..., height, width, channels) image down
+        to 1x1, by a box filter in linear light: color channels are gamma
+        decoded before averaging, alpha is averaged as is """
+    linear = image.astype(np.float32) / 255
+    linear[..., :3] **= GAMMA
+    levels = [image]
+    while max(linear.shape[-3:-1]) > 1:
+        linear = halve(halve(linear, -3), -2)
+        level = linear.copy()
+        level[..., :3] **= 1 / GAMMA
+        levels.append(np.round(level * 255).astype(np.uint8))
+    return levels
+
+
+class CompressedMips:
+    """ S3TC mip chain: the (rows, columns, bytes) 4x4 block arrays of each
+        level, and the (height, width, channels) texel shape of level 0,
+        with a leading layer axis for texture arrays """
+    def __init__(self, levels, shape):
+        self.levels, self.shape = levels, shape
+
+
+def compression():
+    """ whether to upload textures S3TC compressed: unless disabled with
+        TEXTURE_COMPRESSION=0, if the current GL context supports it """
+    return COMPRESSION and bool(glInitTextureCompressionS3TcEXT())
+
+
+def mip_levels(data, height, width, channels, compressed=False):
+    """ views of the successive levels packed in a flat uint8 array, texel
+        arrays or S3TC block arrays if compressed """
+    levels, offset = [], 0
+    for level in range(max(height, width).bit_length()):
+        shape = (max(1, height >> level), max(1, width >> level), channels)
+        if compressed:
+            shape = (-(-shape[0] // 4), -(-shape[1] // 4),
+                     s3tc.BLOCK_BYTES[channels])
+        size = shape[0] * shape[1] * shape[2]
+        levels.append(data[offset:offset + size].reshape(shape))
+        offset += size
+    return levels
+
+
+def load_mips(tex_file, compressed=False):
+    """ Mip chain of an image file, RGB or RGBA, memory mapped from the
+        file.mips.npy cache next to the image when up to date, else built
+        then cached. CompressedMips, from the file.s3tc.npy cache, if
+        compressed. Raises FileNotFoundError for missing images """
+    suffix = '.s3tc.npy' if compressed else '.mips.npy'
+    stat, cache = os.stat(tex_file), tex_file + suffix
+    key = (MIPS_VERSION, stat.st_mtime_ns, stat.st_size)
+    try:
+        data = np.load(cache, mmap_mode='r')
+        header = [int(value) for value
+                  in np.asarray(data[:MIPS_HEADER]).view(np.int64)]
+        if tuple(header[:3]) == key:
+            levels = mip_levels(data[MIPS_HEADER:], *header[3:], compressed)
+            if compressed:
+                return CompressedMips(levels, tuple(header[3:]))
+            return levels
+    except (OSError, ValueError):
+        pass  # no cache, or unreadable one: build again
+
+    if compressed:  # encoded from the uncompressed chain, itself cached
+        levels = load_mips(tex_file)
+        shape, levels = levels[0].shape, [s3tc.encode(level)
+                                          for level in levels]
+    else:
+        levels = build_mips(decode_image(tex_file, reduce=True))
+        shape = levels[0].shape
+    header = np.array(key + shape, np.int64).view(np.uint8)
+    # written aside then renamed, so that readers never see a partial file
+    temporary = '%s.%d.%d.tmp' % (cache, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary, 'wb') as file:
+            np.save(file, np.concatenate([header] + [level.ravel()
+                                                     for level in levels]))
+        os.replace(temporary, cache)
+    except OSError as error:
+        print('WARNING: cannot write cache', cache, error)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return CompressedMips(levels, shape) if compressed else levels
+
+
+# -------------- OpenGL Texture Wrapper ---------------------------------------
+class Texture:
+    """ Helper class to create and automatically destroy textures. Image is
+        the decoded tex_file or its mip levels if already available, e.g.
+        from a loading worker, else the mip levels are loaded from their
+        disk cache, compressed if supported. Asynchronous textures are
+        bound as a placeholder until their image is loaded and streamed by
+        the TextureStreamer """
+    target = GL.GL_TEXTURE_2D  # binding point, see render_state.bind_texture
+    ids = itertools.count(1)   # state_id source, glids change on replace
+
+    def __init__(self, tex_file, wrap_mode=GL.GL_REPEAT,
+                 min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, image=None,
+                 asynchronous=False):
+        self.tex_file = tex_file
+        self.parameters = (wrap_mode, min_filter, mag_filter)
+        self.nbytes, self.shares = 0, 0  # GPU size, extra cache handles
+        self.state_id = next(Texture.ids)  # draw sort key, see core.Mesh
+        self.glid = GL.glGenTextures(1)
+        if asynchronous:
+            self.upload(PLACEHOLDER)
+            streamer.add(self, image)
+            return
+        try:
+            # mip levels as numpy arrays in exactly right format
+            shape = self.upload(load_mips(tex_file, compression())
+                                if image is None else image)
+            message = 'Loaded texture %s\t(%s, %s, %s, %s)'
+            print(message % ((tex_file, shape) + self.parameters))
+        except FileNotFoundError:
+            print("ERROR: unable to load texture file %s" % tex_file)
+
+    def upload(self, tex):
+        """ whole image to the GPU at once, then sampling setup: one array
+            whose mipmaps GL generates, or a list of all mip levels. Arrays
+            have a leading layer axis for array textures. Returns the shape
+            of level 0 """
+        if isinstance(tex, CompressedMips):
+            return self.upload_compressed(tex)
+        levels = [tex] if isinstance(tex, np.ndarray) else tex
+        render_state.bind_texture(self.glid, target=self.target)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # RGB rows are unaligned
+        for level, data in enumerate(levels):
+            internal, layout = FORMATS[data.shape[-1]]
+            data = np.ascontiguousarray(data)
+            if self.target == GL.GL_TEXTURE_2D_ARRAY:
+                GL.glTexImage3D(self.target, level, internal, data.shape[2],
+                                data.shape[1], data.shape[0], 0, layout,
+                                GL.GL_UNSIGNED_BYTE, data)
+            else:
+                GL.glTexImage2D(self.target, level, internal, data.shape[1],
+                                data.shape[0], 0, layout, GL.GL_UNSIGNED_BYTE,
+                                data)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+        self.setup(levels=len(levels))
+        self.resize(levels[0].shape)
+        return levels[0].shape
+
+    def upload_compressed(self, tex):
+        """ upload of S3TC mip levels, see upload """
+        internal, texel_bytes = COMPRESSED[tex.shape[-1]]
+        height, width = tex.shape[-3:-1]
+        render_state.bind_texture(self.glid, target=self.target)
+        for level, data in enumerate(tex.levels):
+            size = (max(1, width >> level), max(1, height >> level))
+            data = np.ascontiguousarray(data)
+            if self.target == GL.GL_TEXTURE_2D_ARRAY:
+                GL.glCompressedTexImage3D(self.target, level, internal, *size,
+                                          tex.shape[0], 0, data.nbytes, data)
+            else:
+                GL.glCompressedTexImage2D(self.target, level, internal, *size,
+                                          0, data.nbytes, data)
+        self.setup(levels=len(tex.levels))
+        self.resize(tex.shape, texel_bytes)
+        return tex.shape
+
+    def setup(self, levels=1):
+        """ sampling parameters & mipmaps of the bound texture, generated by
+            GL unless all the given levels were uploaded """
+        wrap_mode, min_filter, mag_filter = self.parameters
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_MAG_FILTER, min_filter)
+        GL.glTexParameteri(self.target, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
+        if levels > 1:
+            GL.glTexParameteri(self.target, GL.GL_TEXTURE_MAX_LEVEL,
+                               levels - 1)
+        else:
+            GL.glGenerateMipmap(self.target)
+
+    def replace(self, glid, shape):
+        """ swap our GL texture for a complete one, deleting the old one """
+        old, self.glid = self.glid, glid
+        render_state.invalidate()
+        GL.glDeleteTextures(old)
+        self.resize(shape)
+
+    def resize(self, shape, texel_bytes=4):
+        """ GPU bytes bookkeeping for an image shape with mipmaps, texels
+            taking 4 bytes as RGB ones are usually padded, less compressed """
+        nbytes = int(np.prod(shape[:-1]) * texel_bytes * 4 // 3)
+        delta, self.nbytes = nbytes - self.nbytes, nbytes
+        memory_stats['texture_bytes'] += delta
+        memory_stats['texture_bytes_saved'] += delta * self.shares
+
+    def __del__(self):  # delete GL texture from GPU when object dies
+        render_state.invalidate()
+        GL.glDeleteTextures(self.glid)
+        memory_stats['texture_bytes'] -= self.nbytes
+
+
+class TextureArray(Texture):
+    """ Images of several files as the layers of one 2D array texture, in
+        file order, so that meshes of several materials can be drawn at once,
+        shaders picking the layer of each vertex's material. Images of other
+        sizes are scaled to the largest one, uncompressed. Asynchronous
+        arrays are decoded by a streamer worker, placeholder layers being
+        bound until then """
+    target = GL.GL_TEXTURE_2D_ARRAY
+
+    def __init__(self, tex_files, wrap_mode=GL.GL_REPEAT,
+                 min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, asynchronous=False):
+        self.tex_file = tex_files
+        self.parameters = (wrap_mode, min_filter, mag_filter)
+        self.nbytes, self.shares = 0, 0
+        self.state_id = next(Texture.ids)
+        self.glid = GL.glGenTextures(1)
+        if asynchronous:
+            self.upload(np.stack([PLACEHOLDER] * len(tex_files)))
+            self.layers = streamer.submit(self.decode, tex_files,
+                                          compression())
+            frame_tasks.append(self.poll)
+        else:
+            self.load(self.decode(tex_files, compression()))
+
+    @staticmethod
+    def decode(tex_files, compressed=False):
+        """ mip levels of the layers, as (layer, height, width, channels)
+            arrays: stacked from the images' mip caches when they all have
+            the same shape, CompressedMips if compressed, else built from
+            RGBA images at the largest size """
+        try:
+            # shapes checked on the plain chains, encoded only if stacked
+            chains = [load_mips(tex_file) for tex_file in tex_files]
+            stackable = len({chain[0].shape for chain in chains}) == 1
+            if stackable and compressed:
+                chains = [load_mips(tex_file, compressed)
+                          for tex_file in tex_files]
+                return CompressedMips([np.stack(layers) for layers in zip(
+                    *(chain.levels for chain in chains))],
+                    (len(chains),) + chains[0].shape)
+            if stackable:
+                return [np.stack(layers) for layers in zip(*chains)]
+        except FileNotFoundError:
+            pass  # reported below
+        images = []
+        for tex_file in tex_files:
+            try:
+                images.append(Image.open(tex_file).convert('RGBA'))
+            except FileNotFoundError:
+                print("ERROR: unable to load texture file %s" % tex_file)
+                images.append(Image.fromarray(PLACEHOLDER))
+        size = max((image.size for image in images),
+                   key=lambda size: size[0] * size[1])
+        return build_mips(np.stack([np.asarray(image.resize(size,
+                                                            Image.BILINEAR)
+                                               if image.size != size
+                                               else image)
+                                    for image in images]))
+
+    def load(self, levels):
+        """ upload decoded layers, replacing the placeholder ones if any """
+        shape = self.upload(levels)
+        message = 'Loaded texture array %s\t(%s, %s, %s, %s)'
+        print(message % ((self.tex_file, shape) + self.parameters))
+
+    def poll(self):
+        """ frame task uploading decoded layers, False once done """
+        if not self.layers.done():
+            return True
+        self.load(self.layers.result())
+        return False
+
+
+# -------------- streamed texture uploads ------------------------------------
+class PixelUpload:
+    """ One image streamed to a new texture through a pixel buffer object:
+        rows of its level 0 are copied to the PBO, from which
+        glTexSubImage2D reads them without stalling the render thread. The
+        other mip levels, a third of the size, are sent at once at the end """
+    def __init__(self, texture, image):
+        levels = [image] if isinstance(image, np.ndarray) else image
+        self.texture, self.image, self.levels = texture, levels[0], levels[1:]
+        self.row = 0
+        self.internal, self.layout = FORMATS[self.image.shape[2]]
+        self.glid = GL.glGenTextures(1)
+        render_state.bind_texture(self.glid)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, self.internal,
+                        self.image.shape[1], self.image.shape[0], 0,
+                        self.layout, GL.GL_UNSIGNED_BYTE,
+                        None)  # storage only, filled band by band
+        self.pbo = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self.pbo)
+        GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, self.image.nbytes, None,
+                        GL.GL_STREAM_DRAW)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def step(self, budget):
+        """ upload next rows, at least one, within budget bytes, returns
+            the bytes uploaded. Leaves the PBO bound """
+        height, width, channels = self.image.shape
+        stride = width * channels
+        end = min(height, self.row + max(1, budget // stride))
+        offset, size = self.row * stride, (end - self.row) * stride
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self.pbo)
+        GL.glBufferSubData(GL.GL_PIXEL_UNPACK_BUFFER, offset, size,
+                           np.ascontiguousarray(self.image[self.row:end]))
+        render_state.bind_texture(self.glid)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # RGB rows are unaligned
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, self.row, width,
+                           end - self.row, self.layout, GL.GL_UNSIGNED_BYTE,
+                           ctypes.c_void_p(offset))
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+        self.row = end
+        return size
+
+    def finish(self):
+        """ remaining mip levels & sampling setup of the complete texture,
+            handed to its owner. Expects no PBO bound """
+        render_state.bind_texture(self.glid)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        for level, data in enumerate(self.levels, 1):
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, level, self.internal,
+                            data.shape[1], data.shape[0], 0, self.layout,
+                            GL.GL_UNSIGNED_BYTE, np.ascontiguousarray(data))
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+        self.texture.setup(levels=len(self.levels) + 1)
+        self.texture.replace(self.glid, self.image.shape)
+        GL.glDeleteBuffers(1, [self.pbo])
+        message = 'Streamed texture %s\t(%s, %s, %s, %s)'
+        print(message % ((self.texture.tex_file, self.image.shape)
+                         + self.texture.parameters))
+
+
+class TextureStreamer:
+    """ Loads images on worker threads, then streams at most budget bytes
+        of pixels per frame to the GPU, as a core.frame_tasks task """
+    def __init__(self, workers=4, budget=4 << 20):
+        self.workers, self.budget = workers, budget
+        self.pool = None      # worker threads, started on first use
+        self.decoding = []    # (texture, future mip levels) pairs
+        self.uploads = []     # PixelUpload in progress, first one streaming
+
+    def submit(self, function, *args):
+        """ future of function(*args) run by a worker thread """
+        self.pool = self.pool or ThreadPoolExecutor(self.workers)
+        return self.pool.submit(function, *args)
+
+    def add(self, texture, image=None):
+        """ stream image or mip levels, else those of tex_file loaded by a
+            worker, to texture """
+        if image is None:
+            image = self.submit(load_mips, texture.tex_file, compression())
+        self.decoding.append((texture, image))
+        if self.update not in frame_tasks:
+            frame_tasks.append(self.update)
+
+    def update(self):
+        """ one frame of work: start uploads of loaded images, stream the
+            pixels within budget. Returns whether work remains """
+        decoding, self.decoding = self.decoding, []
+        for texture, image in decoding:
+            if hasattr(image, 'done'):  # future of a worker
+                if not image.done():
+                    self.decoding.append((texture, image))
+                    continue
+                try:
+                    image = image.result()
+                except FileNotFoundError:
+                    print("ERROR: unable to load texture file %s"
+                          % texture.tex_file)
+                    continue
+            if isinstance(image, CompressedMips):  # small, sent at once
+                texture.upload(image)
+                frame_stats['texture_bytes_streamed'] += sum(
+                    level.nbytes for level in image.levels)
+                message = 'Loaded texture %s\t(%s, %s, %s, %s)'
+                print(message % ((texture.tex_file, image.shape)
+                                 + texture.parameters))
+                continue
+            self.uploads.append(PixelUpload(texture, image))
+
+        budget = self.budget
+        while self.uploads and budget > 0:
+            upload = self.uploads[0]
+            size = upload.step(budget)
+            budget -= size
+            frame_stats['texture_bytes_streamed'] += size
+            if upload.row == upload.image.shape[0]:
+                GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+                self.uploads.pop(0).finish()
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)  # client memory again
+        return bool(self.decoding or self.uploads)
+
+
+streamer = TextureStreamer()  # single GL context => single upload stream
+
+
+# -------------- textures shared by file & sampling -------------------------
+class TextureHandle:
+    """ Reference to a cached Texture, standing for it, e.g. handle.glid,
+        released from the cache when the handle dies """
+    def __init__(self, cache, key, texture):
+        self.cache, self.key, self.texture = cache, key, texture
+
+    def __getattr__(self, name):  # only called for attributes not set above
+        return getattr(self.texture, name)
+
+    def __del__(self):
+        self.cache.release(self.key)
+
+
+class TextureCache:
+    """ One Texture per image file, modification time, pixel format &
+        sampling parameters, so that each image is decoded and uploaded once
+        per process however many materials or models use it. Handles are
+        reference counted: a texture dies with its last handle """
+    def __init__(self):
+        self.entries = {}  # key -> [Texture, number of live handles]
+
+    @staticmethod
+    def key(tex_file, parameters, pixel_format='RGBA'):
+        """ cache key, a modified file getting a new texture """
+        path = os.path.realpath(tex_file)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None  # missing file, reported by Texture
+        return (path, mtime, pixel_format) + tuple(parameters)
+
+    def get(self, tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
+            mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR, image=None,
+            asynchronous=False):
+        """ TextureHandle of the shared texture, created as by Texture() on
+            first use only """
+        parameters = (wrap_mode, min_filter, mag_filter)
+        key = self.key(tex_file, parameters)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [Texture(tex_file, *parameters,
+                                                 image=image,
+                                                 asynchronous=asynchronous), 0]
+        else:  # shared: one more texture not uploaded
+            entry[0].shares += 1
+            memory_stats['texture_bytes_saved'] += entry[0].nbytes
+        entry[1] += 1
+        return TextureHandle(self, key, entry[0])
+
+    def release(self, key):
+        """ drop a handle, and the texture with the last one """
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.entries[key]
+        else:
+            entry[0].shares -= 1
+            memory_stats['texture_bytes_saved'] -= entry[0].nbytes
+
+    @property
+    def gpu_bytes(self):
+        """ GPU bytes of all cached textures """
+        return sum(texture.nbytes for texture, _ in self.entries.values())
+
+
+textures = TextureCache()  # single GL context => single texture cache
+
+
+# -------------- sampler objects: sampling state apart from textures ---------
+class Sampler:
+    """ OpenGL sampler object, overriding the sampling parameters of the
+        texture bound to the same unit. Parameters are in Texture order """
+    def __init__(self, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
+                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
+        self.parameters = (wrap_mode, min_filter, mag_filter)
+        self.glid = GL.glGenSamplers(1)
+        GL.glSamplerParameteri(self.glid, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glSamplerParameteri(self.glid, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glSamplerParameteri(self.glid, GL.GL_TEXTURE_MAG_FILTER, min_filter)
+        GL.glSamplerParameteri(self.glid, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
+
+    def __del__(self):  # delete GL sampler when object dies
+        render_state.invalidate()
+        GL.glDeleteSamplers(1, [self.glid])
+
+
+class SamplerCache:
+    """ One Sampler per sampling state, kept for the whole run as there are
+        only a few: switching modes is then a mere bind """
+    def __init__(self):
+        self.samplers = {}  # (wrap_mode, min_filter, mag_filter) -> Sampler
+
+    def get(self, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
+            mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
+        """ shared Sampler of these parameters, created on first use """
+        parameters = (wrap_mode, min_filter, mag_filter)
+        if parameters not in self.samplers:
+            self.samplers[parameters] = Sampler(*parameters)
+        return self.samplers[parameters]
+
+
+samplers = SamplerCache()  # single GL context => single sampler set
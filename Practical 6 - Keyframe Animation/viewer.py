@@ -6,16 +6,18 @@ Python OpenGL practical application.
 import os                           # os function, i.e. checking file status
 from itertools import cycle
 import sys
-from PIL import Image               # load images for textures
 
 # External, non built-in modules
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
-import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
-from core import Shader, Mesh, Node, Viewer
+from core import Shader, Mesh, Node, Viewer, VertexArray, render_state
+from core import load_parallel
+from texture import textures, samplers, load_mips, compression
 from transform import rotate,translate,scale
+import meshopt                      # vertex welding
+import meshcache                    # binary cache of imported scenes
 
 from transform import lerp, vec
 from bisect import bisect_left      # search sorted keyframe lists
@@ -23,32 +25,6 @@ from bisect import bisect_left      # search sorted keyframe lists
 from transform import (quaternion_slerp, quaternion_matrix, quaternion,
                        quaternion_from_euler)
 
-# -------------- OpenGL Texture Wrapper ---------------------------------------
-class Texture:
-    """ Helper class to create and automatically destroy textures """
-    def __init__(self, tex_file, wrap_mode=GL.GL_REPEAT, min_filter=GL.GL_LINEAR,
-                 mag_filter=GL.GL_LINEAR_MIPMAP_LINEAR):
-        self.glid = GL.glGenTextures(1)
-        try:
-            # imports image as a numpy array in exactly right format
-            tex = np.asarray(Image.open(tex_file).convert('RGBA'))
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
-            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, tex.shape[1],
-                            tex.shape[0], 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, tex)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, wrap_mode)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, min_filter)
-            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, mag_filter)
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-            message = 'Loaded texture %s\t(%s, %s, %s, %s)'
-            print(message % (tex_file, tex.shape, wrap_mode, min_filter, mag_filter))
-        except FileNotFoundError:
-            print("ERROR: unable to load texture file %s" % tex_file)
-
-    def __del__(self):  # delete GL texture from GPU when object dies
-        GL.glDeleteTextures(self.glid)
-
-
 
         # -------------- Example texture plane class ----------------------------------
 class TexturedMesh(Mesh):
@@ -57,9 +33,6 @@ class TexturedMesh(Mesh):
     def __init__(self,shader, tex, attributes, faces):
         super().__init__(shader, attributes, faces)
 
-        loc = GL.glGetUniformLocation(shader.glid, 'diffuse_map')
-        self.loc['diffuse_map'] = loc
-
         # interactive toggles
         self.wrap = cycle([GL.GL_REPEAT, GL.GL_MIRRORED_REPEAT,
                            GL.GL_CLAMP_TO_BORDER, GL.GL_CLAMP_TO_EDGE])
@@ -68,65 +41,112 @@ class TexturedMesh(Mesh):
                              (GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR)])
         self.wrap_mode, self.filter_mode = next(self.wrap), next(self.filter)
 
-        # setup texture and upload it to GPU
+        # setup texture and upload it to GPU, once: toggles switch samplers
         self.texture = tex
+        self.sampler = samplers.get()  # texture defaults until a toggle
 
     def key_handler(self, key):
         # some interactive elements
         if key == glfw.KEY_F6:
             self.wrap_mode = next(self.wrap)
-            self.texture = Texture(self.tex_file, self.wrap_mode, *self.filter_mode)
+            self.sampler = samplers.get(self.wrap_mode, *self.filter_mode)
         if key == glfw.KEY_F7:
             self.filter_mode = next(self.filter)
-            self.texture = Texture(self.tex_file, self.wrap_mode, *self.filter_mode)
+            self.sampler = samplers.get(self.wrap_mode, *self.filter_mode)
 
     def draw(self, projection, view, model, primitives=GL.GL_TRIANGLES):
-        GL.glUseProgram(self.shader.glid)
+        render_state.use_program(self.shader.glid)
 
-        # texture access setups
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture.glid)
-        GL.glUniform1i(self.loc['diffuse_map'], 0)
+        # texture access setups, only issued when the state changes
+        render_state.bind_texture(self.texture.glid, unit=0)
+        render_state.bind_sampler(self.sampler.glid, unit=0)
+        render_state.uniform1i(self.loc['diffuse_map'], 0)
         super().draw(projection, view, model, primitives)
 
-def load_textured(file, shader, tex_file=None):
-    """ load resources from file using assimp, return list of TexturedMesh """
+def prepare_textured(file, tex_file=None, weld=True, compressed=False):
+    """ CPU side of load_textured, free of OpenGL so that it can run in a
+        worker process: import & weld the meshes of file, load the texture
+        mip chains, S3TC compressed if compressed. Returns picklable
+        (geometry, tex_files, images, size), None on error, tex_files being
+        the texture file of each mesh, images the mip levels of each
+        texture file """
     try:
         pp = assimpcy.aiPostProcessSteps
         flags = pp.aiProcess_Triangulate | pp.aiProcess_FlipUVs
-        scene = assimpcy.aiImportFile(file, flags)
+        scene = meshcache.load_scene(file, flags)  # cached import
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
-        return []
+        return None
 
     # Note: embedded textures not supported at the moment
     path = os.path.dirname(file) if os.path.dirname(file) != '' else './'
+    materials = []
     for mat in scene.mMaterials:
         if not tex_file and 'TEXTURE_BASE' in mat.properties:  # texture token
-            name = os.path.basename(mat.properties['TEXTURE_BASE']) 
+            name = os.path.basename(mat.properties['TEXTURE_BASE'])
             # search texture in file's whole subdir since path often screwed up
             paths = os.walk(path, followlinks=True)
             found = [os.path.join(d, f) for d, _, n in paths for f in n
                      if name.startswith(f) or f.startswith(name)]
             assert found, 'Cannot find texture %s in %s subtree' % (name, path)
             tex_file = found[0]
-        if tex_file:
-            mat.properties['diffuse_map'] = Texture(tex_file=tex_file)
+        materials.append(tex_file)
+    images = {}
+    for texture in set(materials) - {None}:
+        try:
+            images[texture] = load_mips(texture, compressed)  # cached
+        except FileNotFoundError:
+            pass  # reported when creating the texture
+
+    geometry = [([mesh.mVertices, mesh.mTextureCoords[0]], mesh.mFaces)
+                for mesh in scene.mMeshes]
+    if weld:  # duplicate vertices, as assimp does not join them
+        geometry = meshopt.weld_geometry(file, geometry)
+    tex_files = [materials[mesh.mMaterialIndex] for mesh in scene.mMeshes]
+    size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
+    return geometry, tex_files, images, size
+
+
+def build_textured(file, prepared, shader, arena=None):
+    """ GL side of load_textured, on the main thread: upload the prepared
+        meshes & textures of file, return list of TexturedMesh """
+    if prepared is None:
+        return []
+    geometry, tex_files, images, size = prepared
+    maps = {texture: textures.get(texture, image=images.get(texture))
+            for texture in set(tex_files) - {None}}
 
     # prepare textured mesh
     meshes = []
-    for mesh in scene.mMeshes:
-        mat = scene.mMaterials[mesh.mMaterialIndex].properties
-        assert mat['diffuse_map'], "Trying to map using a textureless material"
-        attributes = [mesh.mVertices, mesh.mTextureCoords[0]]
-        mesh = TexturedMesh(shader, mat['diffuse_map'], attributes, mesh.mFaces)
+    for texture, (attributes, faces) in zip(tex_files, geometry):
+        assert texture, "Trying to map using a textureless material"
+        if arena:  # range of the shared GeometryArena buffers
+            attributes = arena.add(attributes, faces)
+        else:
+            attributes = VertexArray(attributes, faces, interleaved=True)
+        mesh = TexturedMesh(shader, maps[texture], attributes, None)
         meshes.append(mesh)
 
-    size = sum((mesh.mNumFaces for mesh in scene.mMeshes))
     print('Loaded %s\t(%d meshes, %d faces)' % (file, len(meshes), size))
     return meshes
 
 
+def load_textured(file, shader, tex_file=None, arena=None, weld=True):
+    """ load resources from file using assimp, return list of TexturedMesh.
+        Weld merges duplicate vertices first """
+    prepared = prepare_textured(file, tex_file, weld, compression())
+    return build_textured(file, prepared, shader, arena)
+
+
+def load_textured_files(files, shader, tex_file=None, arena=None, weld=True):
+    """ load_textured of several files, parsed and decoded in parallel by
+        worker processes while meshes & textures are uploaded here as each
+        file is done. Yields (file, meshes) in completion order """
+    for file, prepared in load_parallel(prepare_textured, files, tex_file,
+                                        weld, compression()):
+        yield file, build_textured(file, prepared, shader, arena)
+
+
 class KeyFrames:
     """ Stores keyframe pairs for any value type with interpolation_function"""
     def __init__(self, time_value_pairs, interpolation_function=lerp):
@@ -178,10 +198,9 @@ class KeyFrameControlNode(Node):
         super().__init__()
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
 
-    def draw(self, projection, view, model):
-        """ When redraw requested, interpolate our node transform from keys """
+    def animate(self):
+        """ Each frame, interpolate our node transform from keys """
         self.transform = self.keyframes.value(glfw.get_time())
-        super().draw(projection, view, model)
 
 
 
@@ -189,10 +208,11 @@ class KeyFrameControlNode(Node):
 def main():
     """ create a window, add scene objects, then run rendering loop """
     viewer = Viewer()
-    shader = Shader("texture.vert", "texture.frag")
+    shader = Shader("texture.vert", "texture.frag", "texture_instanced.vert")
 
-    # viewer.add(*[mesh for file in sys.argv[1:]
-    #            for mesh in load_textured(file, shader)])
+    # files are parsed in parallel, meshes added as soon as each is ready
+    # for _, meshes in load_textured_files(sys.argv[1:], shader):
+    #     viewer.add(*meshes)
 
     # if len(sys.argv) != 2:
     #     print('Usage:\n\t%s [3dfile]*\n\n3dfile\t\t the filename of a model in'